@@ -0,0 +1,448 @@
+#!/usr/bin/env python3
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Client for `mpd` built on `asyncio`.
+
+`mpd.py` blocks and needs a thread per connection. This module lets
+long-running programs (status watchers, prefetchers and the like)
+keep many conversations with MPD going in one thread.
+
+Commands sent via one `AsyncClient` are pipelined: each is sent as
+soon as it's called and MPD answers them in order, so any number of
+commands may be waiting for their responses at the same time::
+
+    async with AsyncClient() as c:
+        status, queue = await asyncio.gather(c.status(), c.queue())
+
+``idle`` is the exception. MPD only accepts ``noidle`` from a client
+that is idle, so give ``idle`` a client of its own.
+
+The coroutines return the same data models as `mpd.py`, but only
+talk to MPD directly: the `mpc` backend, the broker, the index and
+the status board aren't used.
+
+Requires Python 3.5+, so the workflow itself doesn't import it.
+"""
+
+import asyncio
+from collections import deque, OrderedDict
+import itertools
+import logging
+
+from . import mpd
+
+# Maximum length in bytes of a line of a response
+LINE_LIMIT = 2 ** 20
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+class AsyncClient(object):
+    """Connection to MPD for use with `asyncio`.
+
+    Like `mpd.Client`, but its methods are coroutines, which may be
+    called while earlier commands are still waiting for responses.
+    Connects automatically when the first command is sent.
+    """
+
+    def __init__(self, host=None, port=None, password=None, timeout=None):
+        """Create a new (unconnected) client."""
+        default_host, default_password = mpd._host_and_password()
+        self.host = host or default_host
+        self.port = int(port or mpd.MPD_PORT)
+        self.password = password if password is not None \
+            else default_password
+        self.timeout = timeout or mpd.MPD_TIMEOUT
+        self.version = None
+        self._reader = self._writer = None
+        # task that reads responses (see `_receive`)
+        self._receiver = None
+        # ``(command, future)`` of each command awaiting its response,
+        # in the order they were sent
+        self._pending = deque()
+        # set when a command is sent
+        self._sent = None
+        self._idling = False
+        self._connecting = None
+        self._draining = None
+
+    @property
+    def connected(self):
+        """Whether client has an open connection."""
+        return self._writer is not None
+
+    async def __aenter__(self):
+        """Connect to MPD."""
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close connection."""
+        self.close()
+
+    async def connect(self):
+        """Open connection to MPD and log in."""
+        # locks are bound to the event loop, so can't be created earlier
+        if self._connecting is None:
+            self._connecting = asyncio.Lock()
+
+        async with self._connecting:
+            if not self.connected:
+                await self._open()
+
+    async def _open(self):
+        """Open connection and read MPD's greeting."""
+        try:
+            if self.host.startswith('/'):  # Unix domain socket
+                conn = asyncio.open_unix_connection(self.host,
+                                                    limit=LINE_LIMIT)
+            else:
+                conn = asyncio.open_connection(self.host, self.port,
+                                               limit=LINE_LIMIT)
+            reader, writer = await asyncio.wait_for(conn, self.timeout)
+        except (OSError, asyncio.TimeoutError) as err:
+            log.error('could not connect to %s:%s: %s',
+                      self.host, self.port, err)
+            raise mpd.ConnectionError(
+                "Can't connect to MPD",
+                "Are your host & port settings correct? Is MPD running?")
+
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.timeout)
+        except (OSError, ValueError, asyncio.TimeoutError):
+            line = b''
+
+        line = line.decode('utf-8', 'replace').rstrip(u'\n')
+        if not line.startswith(u'OK MPD '):
+            writer.close()
+            raise mpd.ConnectionError("Can't connect to MPD",
+                                      'Unexpected response: ' + line)
+
+        self.version = line[7:].strip()
+        log.debug('connected to MPD %s at %s:%s',
+                  self.version, self.host, self.port)
+
+        self._reader, self._writer = reader, writer
+        self._sent = asyncio.Event()
+        self._draining = asyncio.Lock()
+        self._receiver = asyncio.ensure_future(self._receive())
+
+        if self.password:
+            # sent before any other command can be
+            fut = self._send('password', mpd._command_line(
+                'password', [self.password]))
+            await self._drain()
+            await fut
+
+    def close(self):
+        """Close connection to MPD.
+
+        Commands still waiting for their responses fail with
+        a `mpd.ConnectionError`.
+        """
+        self._disconnect(mpd.ConnectionError('Connection to MPD closed'))
+
+    def _disconnect(self, err):
+        """Close connection and fail pending commands with ``err``."""
+        if self._receiver is not None:
+            self._receiver.cancel()
+
+        if self._writer is not None:
+            self._writer.close()
+
+        self._reader = self._writer = self._receiver = None
+        self._idling = False
+        pending, self._pending = self._pending, deque()
+        for _, fut in pending:
+            if not fut.done():
+                fut.set_exception(err)
+
+    def _server_version(self):
+        """Return version of MPD protocol as a tuple of ints."""
+        return tuple(int(n) for n in self.version.split('.') if n.isdigit())
+
+    def _send(self, command, data):
+        """Send request ``data`` and return future of its response."""
+        fut = asyncio.get_event_loop().create_future()
+        self._pending.append((command, fut))
+        self._writer.write(data)
+        self._sent.set()
+        return fut
+
+    async def _drain(self):
+        """Wait until sent data has been flushed."""
+        if not self.connected:  # connection lost, pending commands failed
+            return
+
+        # concurrent calls to `drain` aren't allowed (before Python 3.10)
+        async with self._draining:
+            try:
+                await self._writer.drain()
+            except OSError as err:
+                self._disconnect(mpd.ConnectionError(
+                    'Connection to MPD lost', str(err)))
+
+    async def _request(self, command, data):
+        """Send request ``data`` and return the response to it."""
+        if not self.connected:
+            await self.connect()
+
+        if self._idling:
+            raise mpd.MPDError('Client is idle',
+                               "Can't send {} while waiting for changes"
+                               .format(command))
+
+        fut = self._send(command, data)
+        await self._drain()
+        return await fut
+
+    async def command(self, command, args=None):
+        """Execute ``command`` and return response."""
+        return await self._request(command, mpd._command_line(command, args))
+
+    async def command_list(self, commands):
+        """Execute several commands in one exchange.
+
+        ``commands`` is a sequence of ``(command, args)`` tuples.
+        Returns a list of responses, one per command.
+        """
+        lines = [mpd._command_line('command_list_ok_begin')]
+        lines.extend(mpd._command_line(c, a) for c, a in commands)
+        lines.append(mpd._command_line('command_list_end'))
+
+        results = []
+        current = []
+        for key, value in await self._request('command_list',
+                                              b''.join(lines)):
+            if key == u'list_OK':
+                results.append(current)
+                current = []
+            else:
+                current.append((key, value))
+
+        return results
+
+    async def _receive(self):
+        """Read responses and pass them to the commands awaiting them."""
+        pairs = []
+        try:
+            while True:
+                if not self._pending:
+                    self._sent.clear()
+                    await self._sent.wait()
+                    continue
+
+                line = await self._readline()
+                if line == u'OK' or line.startswith(u'ACK '):
+                    command, fut = self._pending.popleft()
+                    if fut.done():  # caller stopped waiting
+                        pass
+                    elif line == u'OK':
+                        fut.set_result(pairs)
+                    else:
+                        fut.set_exception(mpd._ack_error(line, command))
+                    pairs = []
+                    continue
+
+                if line == u'list_OK':
+                    pairs.append((u'list_OK', None))
+                    continue
+
+                try:
+                    key, value = line.split(u': ', 1)
+                except ValueError:
+                    raise mpd.ConnectionError('Unexpected response', line)
+
+                if key == u'binary':
+                    try:
+                        size = int(value)
+                    except ValueError:
+                        raise mpd.ConnectionError('Unexpected response',
+                                                  line)
+                    value = await self._readbinary(size)
+
+                pairs.append((key, value))
+
+        except mpd.MPDError as err:
+            self._receiver = None  # don't cancel this task
+            self._disconnect(err)
+        except asyncio.CancelledError:
+            raise
+        except Exception as err:
+            # pending commands would otherwise wait forever
+            log.exception('error reading response')
+            self._receiver = None
+            self._disconnect(mpd.ConnectionError('Connection to MPD lost',
+                                                 str(err)))
+
+    async def _read(self, coro):
+        """Return result of read ``coro``, failing if MPD stops replying."""
+        # MPD takes as long as it likes to report a change
+        timeout = None if self._idling else self.timeout
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except asyncio.TimeoutError:
+            raise mpd.ConnectionError('Connection to MPD lost', 'Timed out')
+        except asyncio.IncompleteReadError:
+            raise mpd.ConnectionError('Connection to MPD lost',
+                                      'Connection closed by server')
+        except (OSError, ValueError) as err:  # ValueError: line too long
+            raise mpd.ConnectionError('Connection to MPD lost', str(err))
+
+    async def _readline(self):
+        """Read one line of a response."""
+        line = await self._read(self._reader.readline())
+        if not line.endswith(b'\n'):
+            raise mpd.ConnectionError('Connection to MPD lost',
+                                      'Connection closed by server')
+
+        try:
+            return line[:-1].decode('utf-8')
+        except UnicodeDecodeError as err:
+            raise mpd.ConnectionError('Unexpected response', str(err))
+
+    async def _readbinary(self, size):
+        """Read ``size`` bytes of binary data plus the trailing newline."""
+        data = await self._read(self._reader.readexactly(size + 1))
+        return data[:-1]
+
+    async def idle(self, subsystems=None):
+        """Wait for changes in MPD subsystems.
+
+        The client can't send other commands while it's waiting.
+        If the coroutine is cancelled, ``noidle`` is sent, so the
+        client can be used again.
+
+        Args:
+            subsystems (list): Subsystems to wait for, e.g. ``database``
+                or ``player``. Wait for any change if empty.
+
+        Returns:
+            list: Names of changed subsystems.
+        """
+        if not self.connected:
+            await self.connect()
+
+        if self._idling:
+            raise mpd.MPDError('Client is idle', 'Already waiting for changes')
+
+        fut = self._send('idle', mpd._command_line('idle', subsystems))
+        self._idling = True
+        try:
+            await self._drain()
+            pairs = await fut
+        except asyncio.CancelledError:
+            self.noidle()
+            raise
+        finally:
+            self._idling = False
+
+        return mpd._values(pairs, 'changed')
+
+    def noidle(self):
+        """Make a waiting `idle` return (with no changes)."""
+        if self._idling and self.connected:
+            self._writer.write(mpd._command_line('noidle'))
+
+    async def search(self, query, offset=0, limit=None, sort=None):
+        """Retrieve matching tracks.
+
+        See `mpd.search_results` for ``offset``, ``limit`` and ``sort``.
+        """
+        return await self._search('search', query, offset, limit, sort)
+
+    async def find(self, query, offset=0, limit=None, sort=None):
+        """Retrieve *exactly* matching tracks.
+
+        See `mpd.search_results` for ``offset``, ``limit`` and ``sort``.
+        """
+        return await self._search('find', query, offset, limit, sort)
+
+    async def _search(self, command, query, offset, limit, sort):
+        """Run search-type ``command`` for ``query``."""
+        terms = mpd._parse_query(query)
+        if limit is None:
+            limit = mpd.MAX_RESULTS
+
+        if not self.connected:
+            await self.connect()
+
+        version = self._server_version()
+        if version >= (0, 21):
+            fetch = command
+            args, local = [mpd._filter_expression(terms, command)], []
+        else:
+            fetch, args, local = mpd._positional_search(command, terms)
+
+        args, skip, stop = mpd._search_options(
+            args, local, offset, offset + limit if limit else None, sort,
+            version)
+        try:
+            pairs = await self.command(fetch, args)
+        except mpd.CommandFailed as err:
+            if err.code != mpd.ACK_ERROR_ARG:
+                raise
+            raise mpd._invalid_type(err, terms, await self.types())
+
+        songs = mpd._iter_song_dicts(pairs, 0)
+        if local:
+            matches = mpd._matcher(local, command)
+            songs = (d for d in songs if matches(d))
+
+        return [mpd._track_from_dict(d)
+                for d in itertools.islice(songs, skip, stop)]
+
+    async def types(self):
+        """Fetch list of valid search types."""
+        return mpd._parse_types(await self.command('tagtypes'))
+
+    async def queue(self):
+        """Retrieve tracks in queue as a `mpd.TrackStore`."""
+        return mpd.TrackStore(
+            mpd._parse_songs(await self.command('playlistinfo')))
+
+    async def status(self):
+        """Retrieve MPD status inc. playing/paused and volume."""
+        st, song = await self.command_list([('status', None),
+                                            ('currentsong', None)])
+        tracks = mpd._parse_songs(song)
+        return mpd._parse_mpd_status(st, tracks[0] if tracks else None)
+
+    async def stats(self):
+        """Fetch statistics about MPD library."""
+        return mpd._parse_stats(await self.command('stats'))
+
+    async def playlists(self):
+        """Fetch lists of available playlists."""
+        return mpd._values(await self.command('listplaylists'), 'playlist')
+
+    async def _list(self, tag, query=None):
+        """List/search distinct values of ``tag``."""
+        if query:
+            pairs = await self.command('search', [tag, query])
+        else:
+            pairs = await self.command('list', [tag])
+
+        return list(OrderedDict.fromkeys(mpd._values(pairs, tag)))
+
+    async def artists(self, query=None):
+        """List/search artists."""
+        return await self._list('artist', query)
+
+    async def albums(self, query=None):
+        """List/search albums."""
+        return await self._list('album', query)
+
+
+async def connect(host=None, port=None, password=None, timeout=None):
+    """Return a connected `AsyncClient`."""
+    c = AsyncClient(host, port, password, timeout)
+    await c.connect()
+    return c
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Memory-mapped board showing MPD's current status.
+
+The watcher (see `watcher.py`) writes the player state, volume, queue
+length and current track to a small file with a fixed layout. The
+workflow reads it via `mmap` instead of asking MPD.
+
+There is only one writer. A sequence lock lets readers detect reads
+that overlap a write (and retry them): the writer makes the sequence
+number odd while it is updating the board, and readers only accept
+data read between two identical, even sequence numbers.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import mmap
+import os
+import struct
+
+from . import mpd
+from .workflow.util import atomic_writer
+
+MAGIC = b'MPDB'
+# Increment when the layout changes
+VERSION = 1
+
+# Maximum length in bytes of each field of the current track
+FIELD_SIZE = 1022
+
+# Magic, version, sequence number and time board was last invalidated
+HEADER = struct.Struct('<4sIId')
+SEQUENCE = struct.Struct('<I')
+SEQUENCE_OFFSET = 8
+INVALIDATED = struct.Struct('<d')
+INVALIDATED_OFFSET = 12
+
+# Time status was fetched, state, song position, queue length, volume,
+# then length and UTF-8 bytes of each field of the current `Track`.
+DATA = struct.Struct('<dbiii' + 'H{}s'.format(FIELD_SIZE) *
+                     len(mpd.Track._fields))
+DATA_OFFSET = HEADER.size
+
+SIZE = HEADER.size + DATA.size
+
+STATES = (u'stop', u'play', u'pause')
+
+# How often a reader tries to get a consistent read before giving up
+READ_TRIES = 100
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+def board_path(dirpath):
+    """Return path of status board in directory ``dirpath``."""
+    return os.path.join(dirpath, 'status.board')
+
+
+class StatusBoard(object):
+    """Fixed-layout status file shared via `mmap`."""
+
+    def __init__(self, path):
+        """Create new board at ``path``."""
+        self.path = path
+        self._mm = None
+
+    def write(self, status, track, fetched):
+        """Update board. Only one process may write to a board.
+
+        Args:
+            status (dict): Response to MPD's ``status`` command.
+            track (Track): Current track or `None`.
+            fetched (float): Time ``status`` was requested.
+        """
+        if self._mm is None:
+            self._create()
+
+        fields = []
+        for value in track or [u''] * len(mpd.Track._fields):
+            value = value.encode('utf-8')
+            if len(value) > FIELD_SIZE:  # board can't show this track
+                log.debug('[board] track field too long: %r', value)
+                fetched = 0
+
+            fields.extend((len(value), value))
+
+        state = status.get(u'state', u'stop')
+        values = [fetched,
+                  STATES.index(state) if state in STATES else 0,
+                  int(status.get(u'song', -1)),
+                  int(status.get(u'playlistlength', 0)),
+                  int(status.get(u'volume', -1))] + fields
+
+        mm = self._mm
+        seq = SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0]
+        SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, seq + 1)
+        DATA.pack_into(mm, DATA_OFFSET, *values)
+        SEQUENCE.pack_into(mm, SEQUENCE_OFFSET, seq + 2)
+
+    def read(self):
+        """Return status and current track from board.
+
+        Returns:
+            tuple: ``(status, track)`` where ``status`` is a dict like
+                the response to MPD's ``status`` command (but only with
+                ``state``, ``song``, ``playlistlength`` and ``volume``)
+                and ``track`` is a `Track` or `None`. Returns `None`
+                if the board doesn't exist or is out of date.
+        """
+        try:
+            with open(self.path, 'rb') as fp:
+                mm = mmap.mmap(fp.fileno(), SIZE, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError, mmap.error):
+            return None
+
+        try:
+            magic, version, _, invalidated = HEADER.unpack_from(mm)
+            if magic != MAGIC or version != VERSION:
+                return None
+
+            for _ in range(READ_TRIES):
+                seq = SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0]
+                if seq % 2:  # being written
+                    continue
+
+                values = DATA.unpack_from(mm, DATA_OFFSET)
+                if SEQUENCE.unpack_from(mm, SEQUENCE_OFFSET)[0] == seq:
+                    break
+            else:
+                log.debug('[board] no consistent read')
+                return None
+        finally:
+            mm.close()
+
+        fetched, state, song, length, volume = values[:5]
+        if not fetched or fetched < invalidated:
+            return None
+
+        status = {u'state': STATES[state], u'playlistlength': length,
+                  u'volume': volume}
+        if song >= 0:
+            status[u'song'] = song
+
+        fields = [values[i + 1][:values[i]].decode('utf-8')
+                  for i in range(5, len(values), 2)]
+        track = mpd.Track(*fields) if fields[-1] else None
+
+        return status, track
+
+    def invalidate(self, when):
+        """Mark status fetched before ``when`` as out of date.
+
+        Called by the workflow after it has changed MPD's state, so
+        readers ask MPD until the watcher has caught up.
+        """
+        try:
+            with open(self.path, 'r+b') as fp:
+                mm = mmap.mmap(fp.fileno(), SIZE)
+        except (IOError, OSError, ValueError, mmap.error):
+            return
+
+        try:
+            INVALIDATED.pack_into(mm, INVALIDATED_OFFSET, when)
+        finally:
+            mm.close()
+
+    def remove(self):
+        """Delete board."""
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    def _create(self):
+        """Create empty board and map it into memory."""
+        with atomic_writer(self.path, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, 0, 0))
+            fp.write(b'\0' * DATA.size)
+
+        with open(self.path, 'r+b') as fp:
+            self._mm = mmap.mmap(fp.fileno(), SIZE)
@@ -0,0 +1,344 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Broker daemon that keeps connections to MPD open.
+
+The broker listens on a Unix domain socket and speaks the MPD protocol
+to its clients. Requests are forwarded to MPD over connections that
+are already open and authenticated, so each workflow run only pays
+for a local IPC hop instead of connecting (and logging in) to a
+possibly-remote MPD.
+
+The broker also runs a `watcher.Watcher`, whose counters are valid
+for as long as the broker is running.
+
+The broker exits when it hasn't had any clients for a while.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import os
+import select
+import socket
+import threading
+import time
+
+from . import mpd
+from .watcher import Watcher
+
+# Maximum length of a Unix socket path (on macOS)
+MAX_SOCKET_PATH = 100
+
+# Maximum number of idle connections to MPD to keep open
+POOL_SIZE = 4
+
+# How often (in seconds) to ping idle MPD connections. MPD closes
+# connections that are idle for 60 seconds by default.
+KEEPALIVE = 30
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+def socket_path(dirpath, name='broker.sock'):
+    """Return path for broker socket in directory ``dirpath``.
+
+    Falls back to ``/tmp`` if the path would be too long for a
+    Unix domain socket.
+    """
+    path = os.path.join(dirpath, name)
+    if len(path) > MAX_SOCKET_PATH:
+        path = '/tmp/alfred-mpd.{}.{}'.format(os.getuid(), name)
+
+    return path
+
+
+def _closed(c):
+    """Whether MPD has closed idle connection ``c``.
+
+    MPD doesn't send anything unasked, so an idle connection that is
+    readable has been closed (or is broken).
+    """
+    try:
+        readable, _, _ = select.select([c], [], [], 0)
+    except (select.error, ValueError):
+        return True
+
+    return bool(readable)
+
+
+def _ack(request, err):
+    """Return ACK response telling client that ``request`` failed."""
+    command = request.split(None, 1)[0].decode('utf-8', 'replace')
+    return u'ACK [{}@0] {{{}}} {}: {}\n'.format(
+        mpd.ACK_ERROR_SYSTEM, command, err.msg, err.reason).encode('utf-8')
+
+
+class Pool(object):
+    """Pool of open connections to MPD."""
+
+    def __init__(self, size=POOL_SIZE):
+        """Create a new, empty pool."""
+        self.size = size
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return an open connection to MPD.
+
+        Pooled connections that MPD has closed are dropped.
+        """
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                c = self._idle.pop()[0]
+
+            if not _closed(c):
+                return c
+
+            log.debug('[broker] dropped closed connection')
+            c.close()
+
+        c = mpd.Client()
+        c.connect()
+        return c
+
+    def put(self, c):
+        """Return connection to the pool."""
+        if not c.connected:
+            return
+
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((c, time.time()))
+                return
+
+        c.close()
+
+    def keepalive(self):
+        """Ping connections that haven't been used for a while."""
+        with self._lock:
+            conns = self._idle
+            self._idle = []
+
+        for c, last_used in conns:
+            if time.time() - last_used < KEEPALIVE:
+                self.put_back(c, last_used)
+                continue
+
+            try:
+                c.command('ping')
+            except mpd.MPDError as err:
+                log.debug('[broker] dropped dead connection: %s', err.msg)
+                c.close()
+                continue
+
+            self.put(c)
+
+    def put_back(self, c, last_used):
+        """Return connection to pool without resetting its timestamp."""
+        with self._lock:
+            self._idle.append((c, last_used))
+
+    def close(self):
+        """Close all connections."""
+        with self._lock:
+            for c, _ in self._idle:
+                c.close()
+            self._idle = []
+
+
+class Broker(object):
+    """Serve MPD protocol on a Unix socket via pooled connections."""
+
+    def __init__(self, path, timeout, watch_dir=None):
+        """Create a new broker on socket ``path``.
+
+        The broker exits after ``timeout`` seconds without clients.
+        If ``watch_dir`` is set, a `Watcher` saves its files there.
+        """
+        self.path = path
+        self.timeout = timeout
+        self.watcher = Watcher(watch_dir) if watch_dir else None
+        self.pool = Pool()
+        self._active = 0
+        self._last_active = time.time()
+        self._lock = threading.Lock()
+
+    def serve(self):
+        """Accept clients until idle timeout expires."""
+        if os.path.exists(self.path):  # stale socket
+            os.unlink(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self.path)
+        sock.listen(16)
+        sock.settimeout(1.0)
+        log.info('[broker] listening on %s', self.path)
+
+        if self.watcher:
+            t = threading.Thread(target=self.watcher.run)
+            t.daemon = True
+            t.start()
+
+        last_keepalive = time.time()
+        try:
+            while not self._expired():
+                try:
+                    conn, _ = sock.accept()
+                except socket.timeout:
+                    if time.time() - last_keepalive > KEEPALIVE:
+                        self.pool.keepalive()
+                        last_keepalive = time.time()
+                    continue
+
+                t = threading.Thread(target=self._handle, args=(conn,))
+                t.daemon = True
+                t.start()
+        finally:
+            log.info('[broker] idle for %ds, exiting ...', self.timeout)
+            sock.close()
+            os.unlink(self.path)
+            self.pool.close()
+            if self.watcher:
+                self.watcher.remove()
+
+    def _expired(self):
+        """Whether broker has been idle too long."""
+        with self._lock:
+            return (not self._active and
+                    time.time() - self._last_active > self.timeout)
+
+    def _touch(self, delta=0):
+        """Update activity counters."""
+        with self._lock:
+            self._active += delta
+            self._last_active = time.time()
+
+    def _handle(self, conn):
+        """Serve one client."""
+        self._touch(1)
+        upstream = None
+        # Unbuffered, so `_wait_idle` can tell via `select` whether
+        # the client has sent anything. Requests are short.
+        rfile = conn.makefile('rb', 0)
+        try:
+            try:
+                upstream = self.pool.get()
+            except mpd.ConnectionError as err:
+                log.error('[broker] %s: %s', err.msg, err.reason)
+                return
+
+            conn.sendall('OK MPD {}\n'.format(upstream.version).encode())
+
+            while True:
+                request = self._read_request(rfile)
+                if not request or request.startswith(b'close'):
+                    break
+
+                self._touch()
+                if request.startswith(b'password '):
+                    # broker logs in to MPD itself
+                    conn.sendall(b'OK\n')
+                    continue
+
+                upstream = self._forward(request, conn, rfile, upstream)
+                if upstream is None:
+                    break
+
+        except (socket.error, mpd.MPDError) as err:
+            log.debug('[broker] client error: %s', err)
+            # upstream may be in the middle of a response
+            if upstream is not None:
+                upstream.close()
+        finally:
+            rfile.close()
+            conn.close()
+            if upstream is not None:
+                self.pool.put(upstream)
+            self._touch(-1)
+
+    def _read_request(self, rfile):
+        """Read a command (or a whole command list) from client."""
+        line = rfile.readline()
+        if not line.startswith(b'command_list_'):
+            return line
+
+        lines = [line]
+        while not line.startswith(b'command_list_end'):
+            line = rfile.readline()
+            if not line:
+                return b''
+            lines.append(line)
+
+        return b''.join(lines)
+
+    def _forward(self, request, conn, rfile, upstream):
+        """Send ``request`` to MPD and relay response to client.
+
+        The request is only sent again (on a new connection) if it
+        couldn't be sent. Once it has been sent, MPD may have executed
+        it, so if the connection is lost, the client gets an error.
+
+        Returns the upstream connection in use afterwards (which may be
+        a new one if MPD was restarted), or `None` if the client
+        should be disconnected.
+        """
+        try:
+            upstream.sendraw(request)
+        except mpd.ConnectionError:
+            # MPD was probably restarted, so the other pooled
+            # connections are dead, too. Reconnect and retry.
+            log.info('[broker] reconnecting to MPD ...')
+            upstream.close()
+            self.pool.close()
+            upstream = self.pool.get()
+            upstream.sendraw(request)
+
+        relayed = [False]
+
+        def write(data):
+            relayed[0] = True
+            conn.sendall(data)
+
+        try:
+            if request.startswith(b'idle'):
+                self._wait_idle(conn, rfile, upstream)
+            upstream.relay(write)
+            return upstream
+        except mpd.ConnectionError as err:
+            upstream.close()
+            log.error('[broker] lost connection to MPD: %s', err.reason)
+            if not relayed[0]:
+                conn.sendall(_ack(request, err))
+            return None
+
+    def _wait_idle(self, conn, rfile, upstream):
+        """Pass ``noidle`` to MPD while waiting for an idle response.
+
+        ``rfile`` must be unbuffered, or a ``noidle`` already read into
+        its buffer wouldn't make ``conn`` readable.
+        """
+        while True:
+            readable, _, _ = select.select([conn, upstream], [], [])
+            if upstream in readable:
+                return
+
+            line = rfile.readline()
+            if not line:
+                raise socket.error('client went away')
+
+            upstream.sendraw(line)
+
+
+def serve(path, timeout, watch_dir=None):
+    """Run broker on socket ``path`` until idle for ``timeout`` seconds."""
+    Broker(path, timeout, watch_dir).serve()
@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Local full-text index of the MPD library.
+
+The index is an SQLite database with an FTS5 table, built from a
+dump of the whole library. Searching it takes the same time no matter
+how large the library is or how busy the server.
+
+The full-text table uses the ``trigram`` tokenizer, so it matches
+case-insensitive substrings, like MPD's ``search``. That needs SQLite
+3.34 or newer (see `AVAILABLE`), and queries of fewer than three
+characters are left to MPD.
+
+After MPD's database has changed, `LibraryIndex.sync` updates the
+index by walking the library's directories and only applying the
+changes.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import os
+import sqlite3
+import time
+
+from . import mpd
+
+# Tags stored in the index. The first six are the fields of `mpd.Track`.
+TAGS = ('artist', 'album', 'disc', 'track', 'title', 'file',
+        'albumartist', 'genre', 'composer', 'performer', 'date')
+
+# Tags matched by ``any``. Like MPD, not the path.
+ANY_TAGS = tuple(t for t in TAGS if t != 'file')
+
+# Increment when the schema changes to force a rebuild
+SCHEMA_VERSION = 3
+
+# Whether SQLite has the ``trigram`` tokenizer the index needs
+AVAILABLE = sqlite3.sqlite_version_info >= (3, 34, 0)
+
+# Shortest value the ``trigram`` tokenizer can match
+MIN_QUERY_LENGTH = 3
+
+# Number of directories to list per exchange with MPD during sync
+SYNC_BATCH_SIZE = 50
+
+SCHEMA = u"""
+CREATE TABLE meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+
+CREATE TABLE directories (
+    path TEXT PRIMARY KEY,
+    last_modified TEXT NOT NULL
+);
+
+CREATE TABLE tracks (
+    id INTEGER PRIMARY KEY,
+    directory TEXT NOT NULL,
+    last_modified TEXT NOT NULL,
+    {columns}
+);
+
+CREATE UNIQUE INDEX tracks_file ON tracks (file);
+CREATE INDEX tracks_directory ON tracks (directory);
+
+CREATE VIRTUAL TABLE tracks_fts USING fts5 (
+    {fts_columns},
+    content='tracks',
+    content_rowid='id',
+    tokenize='trigram'
+);
+""".format(
+    columns=u',\n    '.join(u"{} TEXT NOT NULL DEFAULT ''".format(t)
+                            for t in TAGS),
+    fts_columns=u', '.join(TAGS),
+)
+
+# Keep full-text index in sync with the `tracks` table.
+# Created after the initial bulk insert, which is faster without them.
+TRIGGERS = u"""
+CREATE TRIGGER tracks_ai AFTER INSERT ON tracks BEGIN
+    INSERT INTO tracks_fts (rowid, {columns})
+        VALUES (new.id, {new});
+END;
+
+CREATE TRIGGER tracks_ad AFTER DELETE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, {columns})
+        VALUES ('delete', old.id, {old});
+END;
+
+CREATE TRIGGER tracks_au AFTER UPDATE ON tracks BEGIN
+    INSERT INTO tracks_fts (tracks_fts, rowid, {columns})
+        VALUES ('delete', old.id, {old});
+    INSERT INTO tracks_fts (rowid, {columns})
+        VALUES (new.id, {new});
+END;
+""".format(
+    columns=u', '.join(TAGS),
+    new=u', '.join(u'new.' + t for t in TAGS),
+    old=u', '.join(u'old.' + t for t in TAGS),
+)
+
+INSERT_TRACK = u'INSERT INTO tracks (directory, last_modified, {}) ' \
+               u'VALUES (?, ?, {})'.format(u', '.join(TAGS),
+                                           u', '.join(u'?' * len(TAGS)))
+
+# Params are the same as for INSERT_TRACK minus ``directory``, plus
+# ``file`` of the track to update. Tracks that haven't changed since
+# they were indexed are left alone.
+UPDATE_TRACK = u'UPDATE tracks SET last_modified = ?, {} ' \
+               u'WHERE file = ? AND last_modified != ?1'.format(
+                   u', '.join(u'{} = ?'.format(t) for t in TAGS))
+
+INSERT_DIRECTORY = u'INSERT OR REPLACE INTO directories VALUES (?, ?)'
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+def _fts_query(args):
+    """Turn ``type, value, ...`` search args into an FTS5 query.
+
+    Each value matches as a substring of the tag (of any tag in
+    `ANY_TAGS` for ``any``). Returns `None` if a search type isn't
+    in the index or a value is too short to match.
+    """
+    terms = []
+    for typ, value in zip(args[::2], args[1::2]):
+        typ = typ.lower()
+        if typ == 'any':
+            columns = u' '.join(ANY_TAGS)
+        elif typ in TAGS:
+            columns = typ
+        else:
+            return None
+
+        if len(value) < MIN_QUERY_LENGTH:
+            return None
+
+        terms.append(u'{{{}}} : "{}"'.format(columns,
+                                             value.replace(u'"', u'""')))
+
+    if not terms:
+        return None
+
+    return u' AND '.join(terms)
+
+
+def _exact_query(args):
+    """Turn ``type, value, ...`` search args into an SQL condition.
+
+    Returns ``(sql, params)`` or `None` if a search type isn't
+    in the index.
+    """
+    conditions = []
+    params = []
+    for typ, value in zip(args[::2], args[1::2]):
+        typ = typ.lower()
+        if typ == 'any':
+            conditions.append(u'? IN ({})'.format(u', '.join(ANY_TAGS)))
+        elif typ in TAGS:
+            conditions.append(u'{} = ?'.format(typ))
+        else:
+            return None
+
+        params.append(value)
+
+    return u' AND '.join(conditions), params
+
+
+class LibraryIndex(object):
+    """Full-text index of MPD library stored in SQLite database."""
+
+    def __init__(self, path):
+        """Create new index at ``path``."""
+        self.path = path
+
+    @property
+    def exists(self):
+        """Whether index has been built."""
+        return os.path.exists(self.path)
+
+    def connect(self, path=None):
+        """Return connection to index database."""
+        conn = sqlite3.connect(path or self.path)
+        conn.row_factory = _dict_factory
+        return conn
+
+    def meta(self, key, default=None):
+        """Return value of metadata ``key`` or ``default``."""
+        if not self.exists:
+            return default
+
+        conn = self.connect()
+        try:
+            row = conn.execute(u'SELECT value FROM meta WHERE key = ?',
+                               (key,)).fetchone()
+        except sqlite3.DatabaseError as err:
+            log.error('[index] bad index %s: %s', self.path, err)
+            return default
+        finally:
+            conn.close()
+
+        return row['value'] if row else default
+
+    @property
+    def db_update(self):
+        """Value of MPD's ``db_update`` when index was last updated."""
+        if int(self.meta('schema', 0)) != SCHEMA_VERSION:
+            return 0
+
+        return int(self.meta('db_update', 0))
+
+    def build(self, songs, db_update):
+        """Replace index with ``songs``.
+
+        Args:
+            songs (iterable): Songs and directories as returned
+                by `mpd.library`.
+            db_update (int): MPD's ``db_update`` timestamp.
+        """
+        start = time.time()
+        tmp = self.path + '.{}.tmp'.format(os.getpid())
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+
+        try:
+            conn = self.connect(tmp)
+            try:
+                conn.executescript(SCHEMA)
+                directories = []
+
+                def rows():
+                    for d in songs:
+                        if u'file' in d:
+                            yield _row(d)
+                        elif u'directory' in d:
+                            directories.append((d['directory'],
+                                                d.get('last-modified', u'')))
+
+                conn.executemany(INSERT_TRACK, rows())
+                conn.executemany(INSERT_DIRECTORY, directories)
+                conn.execute(u"INSERT INTO tracks_fts (tracks_fts) "
+                             u"VALUES ('rebuild')")
+                conn.executescript(TRIGGERS)
+                conn.executemany(u'INSERT INTO meta VALUES (?, ?)',
+                                 [('schema', SCHEMA_VERSION),
+                                  ('db_update', db_update),
+                                  ('built', int(time.time()))])
+                conn.commit()
+                row = conn.execute(
+                    u'SELECT COUNT(*) AS n FROM tracks').fetchone()
+            finally:
+                conn.close()
+
+            os.rename(tmp, self.path)
+        except Exception:
+            if os.path.exists(tmp):  # don't leave half-built index
+                os.unlink(tmp)
+            raise
+
+        log.info('[index] indexed %d tracks in %0.2fs',
+                 row['n'], time.time() - start)
+
+    def sync(self, db_update):
+        """Update index to match MPD's database.
+
+        Walks the library with ``lsinfo``, but only lists directories
+        that have subdirectories or whose ``Last-Modified`` has changed.
+        Songs that were changed in place (which doesn't change their
+        directory's ``Last-Modified``) are fetched with ``find
+        modified-since``. Inserts, updates and deletes are applied
+        in a single transaction.
+
+        Args:
+            db_update (int): MPD's ``db_update`` timestamp.
+        """
+        start = time.time()
+        counts = dict(listed=0, inserted=0, updated=0, deleted=0)
+        conn = self.connect()
+        try:
+            since = int(self.meta('db_update', 0))
+            stored = {r['path']: r['last_modified'] for r in
+                      conn.execute(u'SELECT * FROM directories')}
+            parents = {os.path.dirname(p) for p in stored}
+            seen = {u''}
+            pending = [u'']
+            while pending:
+                paths = pending[:SYNC_BATCH_SIZE]
+                pending = pending[SYNC_BATCH_SIZE:]
+                counts['listed'] += len(paths)
+                for path, objs in zip(paths, mpd.lsinfo(paths)):
+                    songs = []
+                    for d in objs:
+                        if u'file' in d:
+                            songs.append(d)
+                            continue
+
+                        subdir = d.get('directory')
+                        if subdir is None:  # playlist
+                            continue
+
+                        seen.add(subdir)
+                        lm = d.get('last-modified', u'')
+                        if stored.get(subdir) == lm and subdir not in parents:
+                            continue  # unchanged leaf directory
+
+                        pending.append(subdir)
+                        if stored.get(subdir) != lm:
+                            conn.execute(INSERT_DIRECTORY, (subdir, lm))
+
+                    self._sync_directory(conn, path, songs, counts)
+
+                log.debug('[index] listed %d directories, %d to go ...',
+                          counts['listed'], len(pending))
+
+            for path in set(stored) - seen:
+                conn.execute(u'DELETE FROM directories WHERE path = ?',
+                             (path,))
+                cur = conn.execute(u'DELETE FROM tracks WHERE directory = ?',
+                                   (path,))
+                counts['deleted'] += cur.rowcount
+
+            for d in mpd.modified_since(since):
+                cur = conn.execute(UPDATE_TRACK, _row(d)[1:] + [d['file']])
+                counts['updated'] += cur.rowcount
+
+            conn.execute(u'UPDATE meta SET value = ? '
+                         u"WHERE key = 'db_update'", (db_update,))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        log.info('[index] synced in %0.2fs (%d of %d directories listed): '
+                 '%d inserted, %d updated, %d deleted',
+                 time.time() - start, counts['listed'], len(seen),
+                 counts['inserted'], counts['updated'], counts['deleted'])
+
+    def _sync_directory(self, conn, path, songs, counts):
+        """Apply changes to songs in directory ``path``."""
+        stored = {r['file']: r['last_modified'] for r in conn.execute(
+            u'SELECT file, last_modified FROM tracks WHERE directory = ?',
+            (path,))}
+
+        for d in songs:
+            lm = stored.pop(d['file'], None)
+            if lm is None:
+                conn.execute(INSERT_TRACK, _row(d))
+                counts['inserted'] += 1
+            elif lm != d.get('last-modified', u''):
+                conn.execute(UPDATE_TRACK, _row(d)[1:] + [d['file']])
+                counts['updated'] += 1
+
+        for f in stored:  # no longer in directory
+            conn.execute(u'DELETE FROM tracks WHERE file = ?', (f,))
+            counts['deleted'] += 1
+
+    def search(self, args, exact=False, limit=0, offset=0, sort=None):
+        """Search index.
+
+        Args:
+            args (list): ``type, value, ...`` as returned by
+                `mpd._positional`.
+            exact (bool): Match whole tag values (like MPD's ``find``)
+                instead of substrings (like ``search``).
+            limit (int): Maximum number of results. 0 means no limit.
+            offset (int): Number of results to skip.
+            sort (str): Tag to sort by (``-`` prefix for descending
+                order) instead of relevance/album order.
+
+        Returns:
+            list: Dicts of tags (best matches first) or `None` if the
+                query can't be answered by the index.
+        """
+        order = None
+        if sort:
+            order = sort.lstrip('-').lower()
+            if order not in TAGS:
+                return None
+            if sort.startswith('-'):
+                order += u' DESC'
+
+        if exact:
+            query = _exact_query(args)
+            if query is None:
+                return None
+            where, params = query
+            sql = u'SELECT * FROM tracks WHERE {} ' \
+                  u'ORDER BY {}artist, album, CAST(disc AS INTEGER), ' \
+                  u'CAST(track AS INTEGER), file ' \
+                  u'LIMIT ? OFFSET ?'.format(where,
+                                             order + u', ' if order else u'')
+        else:
+            query = _fts_query(args)
+            if query is None:
+                return None
+            params = [query]
+            sql = u'SELECT tracks.* FROM tracks_fts ' \
+                  u'JOIN tracks ON tracks.id = tracks_fts.rowid ' \
+                  u'WHERE tracks_fts MATCH ? ORDER BY {} ' \
+                  u'LIMIT ? OFFSET ?'.format(
+                      u'tracks.' + order if order else u'rank')
+
+        start = time.time()
+        conn = self.connect()
+        try:
+            rows = conn.execute(sql,
+                                params + [limit or -1, offset]).fetchall()
+        finally:
+            conn.close()
+
+        log.debug('[index] %d result(s) for %r in %0.3fs',
+                  len(rows), args, time.time() - start)
+        return rows
+
+
+def _dict_factory(cursor, row):
+    """Return database rows as dicts."""
+    return {col[0]: value for col, value in zip(cursor.description, row)}
+
+
+def _row(song):
+    """Return values to insert into ``tracks`` for ``song`` dict."""
+    return ([os.path.dirname(song['file']), song.get('last-modified', u'')] +
+            [song.get(t, u'') for t in TAGS])
@@ -8,26 +8,68 @@
 # Created on 2017-03-13
 #
 
-"""Wrapper around the `mpc` command-line client for `mpd`."""
+"""Client for `mpd`.
+
+Talks to MPD directly via its line-based protocol. The old wrapper
+around the `mpc` command-line client is still available: set
+``MPD_BACKEND`` to ``mpc`` to use it.
+"""
 
 from __future__ import print_function, absolute_import
 
+from array import array
 from collections import namedtuple, OrderedDict
+import functools
+import itertools
 import logging
 import os
 import re
+import select
+import socket
 import subprocess
+import threading
 import time
 
+try:
+    from Queue import Queue
+except ImportError:  # Python 3
+    from queue import Queue
+
 
 MPC = os.getenv('MPC') or 'mpc'
 MPD_HOST = os.getenv('MPD_HOST') or 'localhost'
 MPD_PORT = os.getenv('MPD_PORT') or '6600'
+MPD_PASSWORD = os.getenv('MPD_PASSWORD') or ''
+
+# Connection timeout in seconds
+MPD_TIMEOUT = float(os.getenv('MPD_TIMEOUT') or '10')
+
+# How to talk to MPD. "native" uses the MPD protocol directly,
+# "mpc" calls the `mpc` program.
+BACKEND = os.getenv('MPD_BACKEND') or 'native'
+
+# Path of broker daemon's socket. If set, the native backend talks
+# to MPD via the broker, which holds open connections to MPD.
+BROKER_SOCKET = None
+# Command to start the broker. If the broker isn't running, it is
+# started via `workflow.background.run_in_background`.
+BROKER_COMMAND = None
+
+# Path of local library index (see `index.py`). If set, `search` and
+# `find` use the index instead of asking MPD.
+INDEX_PATH = None
+
+# Path of status board (see `board.py`). If set, `status` reads the
+# board instead of asking MPD (as long as the board is up to date).
+STATUS_BOARD = None
 
 # The maximum number of track that will be read from MPD
 # Set to 0 to fetch all results
 MAX_RESULTS = 0
 
+# Maximum number of threads a `WorkerPool` runs calls in
+POOL_SIZE = 4
+
 # The "wire" format for tracks. This includes all the metadata
 # the workflow needs.
 #
@@ -57,14 +99,21 @@ class MPDError(Exception):
 
 class CommandFailed(MPDError):
     """Raised if MPD doesn't like the input."""
-    def __init__(self, msg, cmd, reason=''):
+    def __init__(self, msg, cmd, reason='', code=None):
         """Create a new MPD error."""
         super(CommandFailed, self).__init__(msg, reason)
         self.cmd = cmd
+        self.code = code
 
 
 class ConnectionError(MPDError):
-    """Raised if a connection can't be established."""
+    """Raised if a connection can't be established or is lost.
+
+    ``retry`` is `True` if the request certainly wasn't executed by
+    MPD, so it's safe to send it again on a new connection.
+    """
+
+    retry = False
 
 
 class InvalidType(MPDError):
@@ -94,6 +143,191 @@ class InvalidType(MPDError):
 Stats = namedtuple('Stats', 'artists albums songs')
 Status = namedtuple('Status', 'track playing index total volume')
 Track = namedtuple('Track', 'artist album disc track title file')
+# Everything the workflow needs to know about the player & library.
+# ``db_update`` is the time the MPD database was last updated.
+Snapshot = namedtuple('Snapshot', 'status current queue_length '
+                                  'stats playlists types db_update')
+
+
+# A term of a parsed query (see `_parse_query`)
+Term = namedtuple('Term', 'type exact negated value')
+
+
+class Results(namedtuple('Results', 'command terms sort offset songs '
+                                     'more complete')):
+    """A page of search results (see `search_results`).
+
+    ``terms`` are the parsed query (see `_parse_query`), ``songs``
+    dicts of tags (see `_parse_objects`) starting at result number
+    ``offset``, and ``more`` is `True` if there are more results.
+    ``complete`` is `True` if ``songs`` are all the results (and so
+    can be refined).
+    """
+
+    __slots__ = ()
+
+    @property
+    def tracks(self):
+        """Results as `Track` tuples."""
+        return [_track_from_dict(d) for d in self.songs]
+
+
+# Fields of `Track` that `TrackStore` keeps as codes of interned strings.
+# The other fields (title and file) are nearly always unique.
+_CODED_FIELDS = Track._fields[:4]
+
+
+class TrackStore(object):
+    """Compact list of tracks, stored column by column.
+
+    Artist, album, disc and track are kept as integer codes into
+    a table of distinct strings, so each value is only held once
+    however many tracks share it. Titles and paths are each
+    concatenated into one UTF-8 buffer. Items are `TrackView` objects,
+    which read their fields from the columns when they're accessed.
+    """
+
+    def __init__(self, tracks=()):
+        """Create new store containing ``tracks``."""
+        self.strings = [u'']
+        self.columns = tuple(array('I') for _ in _CODED_FIELDS)
+        n = len(Track._fields) - len(_CODED_FIELDS)
+        self.buffers = tuple(bytearray() for _ in range(n))
+        self.offsets = tuple(array('I', [0]) for _ in range(n))
+        self._codes = {u'': 0}
+        self.extend(tracks)
+
+    def append(self, track):
+        """Add a `Track` (or sequence of its fields) to the store."""
+        codes = self._codes
+        values = tuple(track)
+        for column, value in zip(self.columns, values):
+            code = codes.get(value)
+            if code is None:
+                code = codes[value] = len(self.strings)
+                self.strings.append(value)
+            column.append(code)
+
+        values = values[len(self.columns):]
+        for buf, offsets, value in zip(self.buffers, self.offsets, values):
+            buf += value.encode('utf-8')
+            offsets.append(len(buf))
+
+    def extend(self, tracks):
+        """Add `Track` tuples to the store."""
+        for track in tracks:
+            self.append(track)
+
+    def field(self, i, n):
+        """Return field number ``n`` of track number ``i``."""
+        if n < len(self.columns):
+            return self.strings[self.columns[n][i]]
+
+        n -= len(self.columns)
+        offsets = self.offsets[n]
+        return self.buffers[n][offsets[i]:offsets[i + 1]].decode('utf-8')
+
+    def __len__(self):
+        """Number of tracks in store."""
+        return len(self.offsets[0]) - 1
+
+    def __getitem__(self, i):
+        """Return `TrackView` (or list of them for a slice)."""
+        if isinstance(i, slice):
+            return [TrackView(self, j) for j in range(*i.indices(len(self)))]
+
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('track index out of range')
+
+        return TrackView(self, i)
+
+    def __iter__(self):
+        """Generate `TrackView` for each track."""
+        for i in range(len(self)):
+            yield TrackView(self, i)
+
+    def __getstate__(self):
+        """Pickle store without the lookup table of codes."""
+        state = self.__dict__.copy()
+        del state['_codes']
+        state['buffers'] = tuple(bytes(buf) for buf in self.buffers)
+        return state
+
+    def __setstate__(self, state):
+        """Restore pickled store."""
+        self.__dict__.update(state)
+        self.buffers = tuple(bytearray(buf) for buf in self.buffers)
+        self._codes = {s: i for i, s in enumerate(self.strings)}
+
+
+def _view_field(n):
+    """Return property that reads field number ``n`` of a `TrackView`."""
+    return property(lambda self: self.store.field(self.index, n))
+
+
+class TrackView(object):
+    """A track in a `TrackStore`.
+
+    Behaves like (and compares equal to) the `Track` with the same
+    fields, but only reads a field from the store when it's accessed.
+    """
+
+    __slots__ = ('store', 'index')
+
+    artist = _view_field(0)
+    album = _view_field(1)
+    disc = _view_field(2)
+    track = _view_field(3)
+    title = _view_field(4)
+    file = _view_field(5)
+
+    def __init__(self, store, index):
+        """Create view of track number ``index`` in ``store``."""
+        self.store = store
+        self.index = index
+
+    def as_track(self):
+        """Return all fields as a `Track`."""
+        return Track(*self)
+
+    def _asdict(self):
+        """Return fields as an `OrderedDict`, like `Track._asdict`."""
+        return self.as_track()._asdict()
+
+    def __iter__(self):
+        """Generate fields in the order of `Track`'s."""
+        for n in range(len(Track._fields)):
+            yield self.store.field(self.index, n)
+
+    def __len__(self):
+        """Number of fields."""
+        return len(Track._fields)
+
+    def __getitem__(self, n):
+        """Return field(s) by position."""
+        return self.as_track()[n]
+
+    def __eq__(self, other):
+        """Compare fields with another view or a `Track`."""
+        if isinstance(other, (tuple, TrackView)):
+            return tuple(self) == tuple(other)
+
+        return NotImplemented
+
+    def __ne__(self, other):
+        """Compare fields with another view or a `Track`."""
+        eq = self.__eq__(other)
+        return eq if eq is NotImplemented else not eq
+
+    def __hash__(self):
+        """Hash like the `Track` with the same fields."""
+        return hash(tuple(self))
+
+    def __repr__(self):
+        """Represent view as the `Track` with the same fields."""
+        return repr(self.as_track())
 
 
 def _stringify(obj):
@@ -114,53 +348,53 @@ def _parse_error_msg(err):
     return err.split(':', 1)[1].strip()
 
 
-def _parse_track_list(out):
-    """Parse `mpc` output into a list of `Track` tuples."""
-    tracks = []
-    lines = out.splitlines()
-    for i, line in enumerate(lines):
-        tracks.append(Track(*line.split(DELIMITER)))
-        if MAX_RESULTS and i >= MAX_RESULTS - 1:
-            log.debug('truncated results to %d/%d', MAX_RESULTS, len(lines))
-            break
-
-    return tracks
+def _parse_track(line):
+    """Parse a line of `mpc` output into a `Track`."""
+    return Track(*line.split(DELIMITER))
 
 
-def mpc(command, args=None, opts=None):
-    """Execute ``mpc`` and return output."""
+def _mpc_command(command, args=None, opts=None):
+    """Build command line to run ``mpc``."""
     command = _stringify(command)
     args = [_stringify(s) for s in args or []]
     opts = [_stringify(s) for s in opts or []]
-    cmd = [MPC, '--host', MPD_HOST, '--port', MPD_PORT] \
+    log.debug('mpc command: %s', [command] + args)
+    return [MPC, '--host', MPD_HOST, '--port', MPD_PORT] \
         + opts \
         + [command] \
         + args
 
-    log.debug('mpc command: %s', [command] + args)
 
+def _mpc_error(cmd, returncode, err):
+    """Return exception for ``mpc`` command that failed with ``err``."""
+    err = _parse_error_msg(err)
+    # Raise custom errors
+    if err == u'Connection refused':
+        return ConnectionError(
+            "Can't connect to MPD",
+            "Are your host & port settings correct? Is MPD running?")
+
+    if 'is not a valid search type' in err:
+        return InvalidType(err)
+
+    log.error('command failed: %s', err)
+
+    return CommandFailed('MPD error ({})'.format(returncode), cmd, err)
+
+
+def mpc(command, args=None, opts=None):
+    """Execute ``mpc`` and return output."""
+    cmd = _mpc_command(command, args, opts)
     start = time.time()
 
     p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     # MPD uses UTF-8 only
     out, err = [s.decode('utf-8') for s in p.communicate()]
-    err = _parse_error_msg(err)
 
     elapsed = time.time() - start
 
     if p.returncode:
-        # Raise custom errors
-        if err == u'Connection refused':
-            raise ConnectionError(
-                "Can't connect to MPD",
-                "Are your host & port settings correct? Is MPD running?")
-
-        if 'is not a valid search type' in err:
-            raise InvalidType(err)
-
-        log.error('command failed: %s', err)
-
-        raise CommandFailed('MPD error ({})'.format(p.returncode), cmd, err)
+        raise _mpc_error(cmd, p.returncode, err)
 
     # log.debug('------------- STDOUT -------------')
     # log.debug(out)
@@ -174,85 +408,1278 @@ def mpc(command, args=None, opts=None):
     return out
 
 
-def mpctracks(command, args=None):
-    """Fetch a list of `Track` tuples from MPD."""
-    out = mpc(command, args, ('-f', RESULT_FORMAT))
-    return _parse_track_list(out)
+def mpctracks(command, args=None, limit=None):
+    """Generate `Track` tuples from MPD via ``mpc``.
+
+    Tracks are parsed as ``mpc`` outputs them. After ``limit`` tracks
+    (default `MAX_RESULTS`, 0 means no limit) or if the generator is
+    closed, ``mpc`` is killed, which cancels the rest of the response.
+    """
+    if limit is None:
+        limit = MAX_RESULTS
+
+    cmd = _mpc_command(command, args, ('-f', RESULT_FORMAT))
+    start = time.time()
+
+    p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    try:
+        count = 0
+        for line in iter(p.stdout.readline, b''):
+            yield _parse_track(line.decode('utf-8').rstrip(u'\n'))
+            count += 1
+            if limit and count >= limit:
+                log.debug('truncated results to %d', limit)
+                return
+
+        err = p.stderr.read().decode('utf-8')
+        if p.wait():
+            raise _mpc_error(cmd, p.returncode, err)
+
+    finally:
+        if p.poll() is None:  # stopped early
+            p.kill()
+            p.wait()
+
+        p.stdout.close()
+        p.stderr.close()
+        log.debug('Finished in %0.2fs', time.time() - start)
+
+
+# Error codes in MPD's ACK responses
+ACK_ERROR_ARG = 2
+ACK_ERROR_PASSWORD = 3
+ACK_ERROR_PERMISSION = 4
+ACK_ERROR_UNKNOWN = 5
+ACK_ERROR_NO_EXIST = 50
+ACK_ERROR_SYSTEM = 52
+
+_match_ack = re.compile(r'ACK \[(\d+)@(\d+)\] \{(.*?)\} ?(.*)').match
+
+
+def _text(obj):
+    """Turn ``obj`` into Unicode text for the MPD protocol."""
+    if isinstance(obj, bytes):
+        return obj.decode('utf-8')
+
+    return u'{}'.format(obj)
+
+
+def _quote(arg):
+    """Quote and escape an argument to an MPD command."""
+    arg = _text(arg).replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+    return u'"{}"'.format(arg)
+
+
+def _command_line(command, args=None):
+    """Build the (UTF-8-encoded) line that sends ``command`` to MPD."""
+    parts = [_text(command)] + [_quote(a) for a in args or []]
+    return (u' '.join(parts) + u'\n').encode('utf-8')
+
+
+def _ack_error(line, command):
+    """Create a `CommandFailed` exception from an ACK response."""
+    m = _match_ack(line)
+    if not m:
+        return CommandFailed('MPD error', command, line)
+
+    code, _, cmd, msg = m.groups()
+    code = int(code)
+    log.error('command failed: [%d] {%s} %s', code, cmd, msg)
+    return CommandFailed('MPD error ({})'.format(code),
+                         cmd or command, msg, code)
+
+
+def _host_and_password():
+    """Return ``(host, password)`` from the settings.
+
+    Like `mpc`, accept a password in ``MPD_HOST`` in the form
+    ``password@host``.
+    """
+    host, password = MPD_HOST, MPD_PASSWORD
+    if '@' in host and not host.startswith('/'):
+        pw, host = host.split('@', 1)
+        password = password or pw
+
+    return host, password
+
+
+class Client(object):
+    """Connection to MPD speaking its line-based protocol.
+
+    Responses are lists of ``(key, value)`` tuples. Values are
+    Unicode, except for ``binary`` responses, which are bytes.
+
+    A `ConnectionError` raised while sending a request or reading
+    the response says whether the request may be retried (see
+    `_lost`).
+    """
+
+    def __init__(self, host=None, port=None, password=None, timeout=None):
+        """Create a new (unconnected) client."""
+        default_host, default_password = _host_and_password()
+        self.host = host or default_host
+        self.port = int(port or MPD_PORT)
+        self.password = password if password is not None \
+            else default_password
+        self.timeout = timeout or MPD_TIMEOUT
+        self.version = None
+        self._sock = None
+        self._rfile = None
+
+    @property
+    def connected(self):
+        """Whether client has an open connection."""
+        return self._sock is not None
+
+    def connect(self):
+        """Open connection to MPD and log in."""
+        try:
+            if self.host.startswith('/'):  # Unix domain socket
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.settimeout(self.timeout)
+                sock.connect(self.host)
+            else:
+                sock = socket.create_connection((self.host, self.port),
+                                                self.timeout)
+        except socket.error as err:
+            log.error('could not connect to %s:%s: %s',
+                      self.host, self.port, err)
+            raise ConnectionError(
+                "Can't connect to MPD",
+                "Are your host & port settings correct? Is MPD running?")
+
+        self._sock = sock
+        self._rfile = sock.makefile('rb')
+
+        try:
+            line = self._readline()
+        except ConnectionError:
+            raise ConnectionError(
+                "Can't connect to MPD",
+                "Are your host & port settings correct? Is MPD running?")
+
+        if not line.startswith(u'OK MPD '):
+            self.close()
+            raise ConnectionError("Can't connect to MPD",
+                                  'Unexpected response: ' + line)
+
+        self.version = line[7:].strip()
+        log.debug('connected to MPD %s at %s:%s',
+                  self.version, self.host, self.port)
+
+        if self.password:
+            self.command('password', [self.password])
+
+    def close(self):
+        """Close connection to MPD."""
+        for obj in (self._rfile, self._sock):
+            if obj is None:
+                continue
+            try:
+                obj.close()
+            except socket.error:
+                pass
+
+        self._sock = self._rfile = None
+
+    def _readline(self):
+        """Read one line of the response."""
+        try:
+            line = self._rfile.readline()
+        except socket.timeout:
+            raise self._lost('Timed out')
+        except socket.error as err:
+            raise self._lost(str(err))
+
+        if not line.endswith(b'\n'):
+            raise self._lost('Connection closed by server')
+
+        return line[:-1].decode('utf-8')
+
+    def _readbinary(self, size):
+        """Read ``size`` bytes of binary data plus the trailing newline."""
+        data = b''
+        while len(data) < size + 1:
+            try:
+                chunk = self._rfile.read(size + 1 - len(data))
+            except socket.timeout:
+                raise self._lost('Timed out')
+            except socket.error as err:
+                raise self._lost(str(err))
+
+            if not chunk:
+                raise self._lost('Connection closed by server')
+            data += chunk
+
+        return data[:-1]
+
+    def _lost(self, reason, sent=True):
+        """Close connection and return `ConnectionError` for ``reason``.
+
+        The request may only be retried if it wasn't ``sent``: once
+        MPD has it, it may execute it, even if it never replies.
+        """
+        self.close()
+        err = ConnectionError('Connection to MPD lost', reason)
+        err.retry = not sent
+        return err
+
+    def _closed(self):
+        """Whether MPD has closed the (idle) connection.
+
+        MPD doesn't send anything unasked, so an idle connection that
+        is readable has been closed (it closes idle connections after
+        ``connection_timeout``) or is broken.
+        """
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+            if not readable:
+                return False
+            return not self._sock.recv(1, socket.MSG_PEEK)
+        except (select.error, socket.error, ValueError):
+            return True
+
+    def send(self, command, args=None):
+        """Send ``command`` to MPD without reading the response."""
+        self.sendraw(_command_line(command, args))
+
+    def iter_response(self, command=None):
+        """Generate ``(key, value)`` tuples until MPD says ``OK``.
+
+        ``list_OK`` lines (from command lists) are passed through
+        as ``(u'list_OK', None)``.
+        """
+        while True:
+            line = self._readline()
+            if line == u'OK':
+                return
+
+            if line == u'list_OK':
+                yield u'list_OK', None
+                continue
+
+            if line.startswith(u'ACK '):
+                raise _ack_error(line, command)
+
+            key, value = line.split(u': ', 1)
+            if key == u'binary':
+                yield key, self._readbinary(int(value))
+                continue
+
+            yield key, value
+
+    def read_response(self, command=None):
+        """Return response to a command as a list of tuples."""
+        return list(self.iter_response(command))
+
+    def command(self, command, args=None):
+        """Execute ``command`` and return response."""
+        self.send(command, args)
+        return self.read_response(command)
+
+    def command_list(self, commands):
+        """Execute several commands in one exchange.
+
+        ``commands`` is a sequence of ``(command, args)`` tuples.
+        Returns a list of responses, one per command.
+        """
+        lines = [_command_line('command_list_ok_begin')]
+        lines.extend(_command_line(c, a) for c, a in commands)
+        lines.append(_command_line('command_list_end'))
+        self.sendraw(b''.join(lines))
+
+        results = []
+        current = []
+        for key, value in self.iter_response('command_list'):
+            if key == u'list_OK':
+                results.append(current)
+                current = []
+            else:
+                current.append((key, value))
+
+        return results
+
+    def binary(self, command, uri):
+        """Fetch all chunks of binary ``command`` (e.g. ``albumart``)."""
+        data = b''
+        size = None
+        while size is None or len(data) < size:
+            chunk = b''
+            for key, value in self.command(command, [uri, len(data)]):
+                if key == u'size':
+                    size = int(value)
+                elif key == u'binary':
+                    chunk = value
+
+            if not chunk:
+                break
+            data += chunk
+
+        return data
+
+    def settimeout(self, timeout):
+        """Set socket timeout. `None` means block forever (for ``idle``)."""
+        if not self.connected:
+            self.connect()
+
+        self._sock.settimeout(timeout)
+
+    def fileno(self):
+        """Return file descriptor of the socket (for `select`)."""
+        return self._sock.fileno()
+
+    def sendraw(self, data):
+        """Send already-encoded request ``data`` to MPD."""
+        if not self.connected:
+            self.connect()
+
+        if self._closed():
+            raise self._lost('Connection closed by server', sent=False)
+
+        try:
+            self._sock.sendall(data)
+        except socket.error as err:
+            # MPD only executes complete lines (and command lists),
+            # so a partly sent request is never executed
+            raise self._lost(str(err), sent=False)
+
+    def relay(self, write):
+        """Pass the raw response to a request to callable ``write``.
+
+        Returns after the final ``OK`` or ``ACK`` line.
+        """
+        while True:
+            line = self._readline()
+            write(line.encode('utf-8') + b'\n')
+            if line == u'OK' or line.startswith(u'ACK '):
+                return
+
+            if line.startswith(u'binary: '):
+                write(self._readbinary(int(line[8:])) + b'\n')
+
+
+# Each thread has its own connection (see `client`)
+_local = threading.local()
+
+
+def _start_broker():
+    """Start broker daemon in the background."""
+    from .workflow.background import is_running, run_in_background
+    if not BROKER_COMMAND or is_running('mpd-broker'):
+        return
+
+    log.debug('starting broker ...')
+    run_in_background('mpd-broker', BROKER_COMMAND)
+
+
+def _connect():
+    """Connect to the broker (if enabled) or directly to MPD."""
+    if BROKER_SOCKET:
+        c = Client(BROKER_SOCKET, password='')
+        try:
+            c.connect()
+            log.debug('connected via broker')
+            return c
+        except ConnectionError:
+            _start_broker()
+
+    c = Client()
+    c.connect()
+    return c
+
+
+def client():
+    """Return a connected `Client` for this thread.
+
+    The thread's existing client is reused if it's still connected.
+    """
+    c = getattr(_local, 'client', None)
+    if c is None or not c.connected:
+        c = _local.client = _connect()
+
+    return c
+
+
+class Future(object):
+    """Result of a call run by a `WorkerPool`."""
+
+    def __init__(self):
+        """Create new, unfinished future."""
+        self._done = threading.Event()
+        self._result = None
+        self._error = None
+
+    def done(self):
+        """Whether the call has finished."""
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Wait for the call to finish and return its result.
+
+        Raises the call's exception if it failed, or `MPDError` if
+        it hasn't finished within ``timeout`` seconds.
+        """
+        if not self._done.wait(timeout):
+            raise MPDError('Timeout', 'call still running after {}s'.format(
+                timeout))
+
+        if self._error is not None:
+            raise self._error
+
+        return self._result
+
+    def _finish(self, result=None, error=None):
+        """Set result or exception of the call."""
+        self._result = result
+        self._error = error
+        self._done.set()
+
+
+class WorkerPool(object):
+    """Runs independent, read-only calls in a bounded number of threads.
+
+    Each thread talks to MPD via its own connection (see `client`),
+    which is closed when the pool is shut down. Use it as a context
+    manager::
+
+        with WorkerPool() as pool:
+            counts = pool.submit(stats)
+            names = pool.submit(playlists)
+
+        log.debug('%d playlists', len(names.result()))
+
+    """
+
+    def __init__(self, size=POOL_SIZE):
+        """Create new pool of up to ``size`` threads."""
+        self.size = size
+        self._calls = Queue()
+        self._threads = []
+
+    def submit(self, func, *args, **kwargs):
+        """Call ``func`` with ``args`` and ``kwargs`` in a worker thread.
+
+        Returns:
+            Future: Result of the call.
+        """
+        future = Future()
+        self._calls.put((future, func, args, kwargs))
+        if len(self._threads) < self.size:
+            t = threading.Thread(target=self._work)
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+        return future
+
+    def shutdown(self):
+        """Wait for all calls to finish and stop the threads."""
+        for _ in self._threads:
+            self._calls.put(None)
+        for t in self._threads:
+            t.join()
+
+        self._threads = []
+
+    def _work(self):
+        """Run calls until `shutdown`."""
+        try:
+            while True:
+                call = self._calls.get()
+                if call is None:
+                    return
+
+                future, func, args, kwargs = call
+                try:
+                    future._finish(func(*args, **kwargs))
+                except Exception as err:
+                    future._finish(error=err)
+        finally:
+            c = getattr(_local, 'client', None)
+            if c is not None:
+                c.close()
+
+    def __enter__(self):
+        """Return the pool."""
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        """Shut down the pool."""
+        self.shutdown()
+
+
+def mpd(command, args=None):
+    """Execute ``command`` via the MPD protocol and return response."""
+    log.debug('mpd command: %s', [command] + list(args or []))
+    start = time.time()
+    try:
+        out = client().command(command, args)
+    except ConnectionError as err:
+        if not err.retry:
+            raise
+        # Server (or broker) may have been restarted.
+        # Try again with a new connection.
+        log.debug('reconnecting to MPD ...')
+        out = client().command(command, args)
+
+    log.debug('Finished in %0.2fs', time.time() - start)
+    return out
+
+
+def mpdlist(commands):
+    """Execute several commands in one exchange and return responses.
+
+    ``commands`` is a sequence of ``(command, args)`` tuples.
+    """
+    log.debug('mpd command list: %s', [c for c, _ in commands])
+    start = time.time()
+    try:
+        out = client().command_list(commands)
+    except ConnectionError as err:
+        if not err.retry:
+            raise
+        log.debug('reconnecting to MPD ...')
+        out = client().command_list(commands)
+
+    log.debug('Finished in %0.2fs', time.time() - start)
+    return out
+
+
+def mpditer(command, args=None):
+    """Execute ``command`` and generate response as it arrives.
+
+    If the generator is closed before the end of the response, the
+    connection is closed, which cancels the rest of the response.
+    No other commands may be sent until the generator is done.
+    """
+    log.debug('mpd command: %s', [command] + list(args or []))
+    start = time.time()
+    for attempt in (1, 2):
+        c = client()
+        try:
+            c.send(command, args)
+            pairs = c.iter_response(command)
+            pair = next(pairs)
+            break
+        except StopIteration:  # empty response
+            return
+        except ConnectionError as err:
+            if attempt == 2 or not err.retry:
+                raise
+            # Server (or broker) may have been restarted.
+            # Try again with a new connection.
+            log.debug('reconnecting to MPD ...')
+
+    complete = False
+    try:
+        yield pair
+        for pair in pairs:
+            yield pair
+
+        complete = True
+    finally:
+        if not complete and c.connected:
+            log.debug('cancelling rest of response ...')
+            c.close()
+
+        log.debug('Finished in %0.2fs', time.time() - start)
+
+
+def mpdtracks(command, args=None):
+    """Generate `Track` tuples via the MPD protocol.
+
+    Tracks are parsed as they arrive. The rest of the response is
+    cancelled after `MAX_RESULTS` tracks (see `mpditer`).
+    """
+    pairs = mpditer(command, args)
+    try:
+        for d in _iter_song_dicts(pairs):
+            yield _track_from_dict(d)
+    finally:
+        pairs.close()
+
+
+# Commands that change the queue (see `Batch.changes_queue`)
+_QUEUE_COMMANDS = {'add', 'addid', 'clear', 'delete', 'deleteid', 'findadd',
+                   'load', 'move', 'moveid', 'searchadd', 'shuffle'}
+
+
+class Batch(object):
+    """Collects commands and sends them to MPD in one command list.
+
+    Create via :func:`batch`. While the batch is active, functions
+    that change MPD's state (`queue_track`, `remove_track`, `clear`,
+    `play`, the volume functions etc.) add their commands to the
+    batch instead of executing them. The functions that usually return
+    a `Status` return `None` instead.
+
+    When the ``with`` block exits, the commands are sent to MPD and
+    the response to each command is available in ``results``.
+    Commands are discarded if the block raises an exception.
+
+    Batches only apply to the native backend and to the thread that
+    opened them: commands sent by other threads (e.g. a `WorkerPool`)
+    are executed as usual.
+    """
+
+    def __init__(self):
+        """Create new, empty batch."""
+        self.commands = []
+        self.results = []
+        self._depth = 0
+
+    def add(self, command, args=None):
+        """Add ``command`` to batch."""
+        self.commands.append((command, args))
+
+    @property
+    def cleared(self):
+        """Whether the queue will be empty once the batch is sent.
+
+        `True` if the batch clears the queue and doesn't add songs
+        after that.
+        """
+        for command, _ in reversed(self.commands):
+            if command == 'clear':
+                return True
+            if command in _QUEUE_COMMANDS:
+                return False
+
+        return False
+
+    @property
+    def changes_queue(self):
+        """Whether the batch contains commands that change the queue."""
+        return any(c in _QUEUE_COMMANDS for c, _ in self.commands)
+
+    def send(self):
+        """Send batched commands to MPD and return their responses."""
+        if self.commands:
+            self.results = mpdlist(self.commands)
+            self.commands = []
+
+        return self.results
+
+    def __enter__(self):
+        """Make this the active batch of the current thread."""
+        if _active_batch() is None:
+            _local.batch = self
+        self._depth += 1
+        return self
+
+    def __exit__(self, typ, value, traceback):
+        """Send batched commands."""
+        self._depth -= 1
+        if self._depth:  # nested batch
+            return
+
+        _local.batch = None
+        if typ is None:
+            self.send()
+
+
+def _active_batch():
+    """Return the active `Batch` of the current thread or `None`."""
+    return getattr(_local, 'batch', None)
+
+
+def batch():
+    """Return a context manager that batches commands.
+
+    Nested calls return the active batch, so all commands go to MPD
+    in one exchange when the outermost ``with`` block exits.
+
+    Example::
+
+        with batch() as b:
+            for track in find('album:Kid A'):
+                queue_track(track)
+
+        log.debug('%d tracks queued', len(b.results))
+
+    """
+    return _active_batch() or Batch()
+
+
+def _run(command, args=None):
+    """Execute ``command`` or add it to the active batch."""
+    b = _active_batch()
+    if b is not None:
+        b.add(command, args)
+        return None
+
+    return mpd(command, args)
+
+
+def _values(pairs, key):
+    """Return all values for ``key`` (case-insensitive) in ``pairs``."""
+    key = key.lower()
+    return [v for k, v in pairs if k.lower() == key]
+
+
+def _iter_objects(pairs, delimiters=(u'file',), multi=False):
+    """Split ``pairs`` into dicts on keys in ``delimiters``.
+
+    Keys are lowercased. Only the first value of multi-value
+    tags is kept, unless ``multi`` is `True`, in which case their
+    values are lists of all values (see `_first`). Pairs before the
+    first delimiter are ignored. Each dict is generated as soon as
+    the next one starts.
+    """
+    obj = None
+    for key, value in pairs:
+        key = key.lower()
+        if key in delimiters:
+            if obj is not None:
+                yield obj
+            obj = {key: value}
+        elif obj is None:
+            continue
+        elif key not in obj:
+            obj[key] = value
+        elif multi:
+            if isinstance(obj[key], list):
+                obj[key].append(value)
+            else:
+                obj[key] = [obj[key], value]
+
+    if obj is not None:
+        yield obj
+
+
+def _parse_objects(pairs, delimiters=(u'file',)):
+    """Return list of dicts from ``pairs`` (see `_iter_objects`)."""
+    return list(_iter_objects(pairs, delimiters))
+
+
+def _first(value):
+    """Return first value of a (possibly multi-value) tag."""
+    return value[0] if isinstance(value, list) else value
+
+
+def _all(value):
+    """Return all values of a (possibly multi-value) tag as a list."""
+    return value if isinstance(value, list) else [value]
+
+
+def _track_from_dict(d):
+    """Create a `Track` from a parsed MPD song."""
+    return Track(*[_first(d.get(k, u'')) for k in Track._fields])
+
+
+def _iter_song_dicts(pairs, limit=None):
+    """Generate dicts of tags from MPD song list.
+
+    All values of multi-value tags are kept (see `_iter_objects`),
+    so the songs can be refined like MPD searches them.
+    Stops reading ``pairs`` after ``limit`` songs (default
+    `MAX_RESULTS`, 0 means no limit).
+    """
+    if limit is None:
+        limit = MAX_RESULTS
+
+    count = 0
+    for d in _iter_objects(pairs, (u'file', u'directory', u'playlist'),
+                           multi=True):
+        if u'file' not in d:
+            continue
+
+        yield d
+        count += 1
+        if limit and count >= limit:
+            log.debug('truncated results to %d', limit)
+            return
+
+
+def _parse_song_dicts(pairs):
+    """Parse MPD song list into dicts of tags."""
+    return list(_iter_song_dicts(pairs))
+
+
+def _parse_songs(pairs):
+    """Parse MPD song list into `Track` tuples."""
+    return [_track_from_dict(d) for d in _parse_song_dicts(pairs)]
+
+
+def _parse_mpd_status(pairs, cur=None):
+    """Create a `Status` from response to ``status`` command."""
+    d = {k: v for k, v in pairs}
+    state = d.get(u'state', u'stop')
+    pos = count = 0
+    if state != u'stop' and u'song' in d:
+        pos = int(d[u'song']) + 1
+        count = int(d.get(u'playlistlength', 0))
+    else:
+        cur = None
+
+    volume = int(d.get(u'volume', -1))
+    if volume < 0:  # hardware mixer
+        volume = 'n/a'
+
+    log.debug('state=%r, pos=%r, count=%r, volume=%r',
+              state, pos, count, volume)
+    return Status(cur, state == u'play', pos, count, volume)
+
+
+def _invalid_type(err, terms, valid=None):
+    """Turn failed search ``err`` into an `InvalidType` error if possible.
+
+    ``valid`` are the search types (default: fetch them via `types`).
+    """
+    if err.code != ACK_ERROR_ARG:
+        return err
+
+    valid = valid or types()
+    for typ in set(t.type for t in terms):
+        if typ.lower() not in valid:
+            return InvalidType(u'"{}" is not a valid search type: <{}>'.format(
+                typ, u'|'.join(valid)))
+
+    return err
 
 
 def version():
     """Fetch MPD API version."""
-    # sample output:
-    # mpd version: 0.20.0
-    s = mpc('version')
-    return s.split(':')[-1].strip()
+    if BACKEND == 'mpc':
+        # sample output:
+        # mpd version: 0.20.0
+        s = mpc('version')
+        return s.split(':')[-1].strip()
+
+    return client().version
 
 
 def playlists():
     """Fetch lists of available playlists."""
-    return mpc('lsplaylists').splitlines()
+    if BACKEND == 'mpc':
+        return mpc('lsplaylists').splitlines()
+
+    return _values(mpd('listplaylists'), 'playlist')
+
+
+# MPD's tag types
+TYPES = frozenset((
+    'artist', 'artistsort', 'album', 'albumsort', 'albumartist',
+    'albumartistsort', 'title', 'titlesort', 'track', 'name', 'genre',
+    'mood', 'date', 'originaldate', 'composer', 'composersort', 'performer',
+    'conductor', 'work', 'ensemble', 'movement', 'movementnumber',
+    'showmovement', 'location', 'grouping', 'comment', 'disc', 'label',
+    'musicbrainz_artistid', 'musicbrainz_albumid',
+    'musicbrainz_albumartistid', 'musicbrainz_trackid',
+    'musicbrainz_releasegroupid', 'musicbrainz_releasetrackid',
+    'musicbrainz_workid',
+))
+
+# Types a query term may have: tags plus MPD's special search types
+SEARCH_TYPES = TYPES | {'any', 'file', 'base', 'modified-since',
+                        'added-since'}
+
+# ``[!]type`` and operator at the start of a query term
+_match_type = re.compile(r'(!?)([a-zA-Z][\w-]*)(!=|=|:)').match
+# Quoted or bare value of a query term
+_match_value = re.compile(r'"((?:[^"\\]|\\.?)*)"?|((?:[^\s\\]|\\.?)*)',
+                          re.UNICODE).match
+_unescape = functools.partial(re.compile(r'\\(.)', re.UNICODE).sub, r'\1')
 
 
 def _parse_query(query):
-    """Parse ``type:query`` elements in type & query pairs."""
-    if ':' not in query:
-        return ['any', query]
-
-    pairs = []
-    for word in query.split():
-        if ':' in word:
-            pairs.append(word.split(':'))
+    """Parse ``query`` into a list of `Term` tuples.
+
+    ``type:value`` matches like the search command does (substring
+    for ``search``, exact for ``find``), ``type=value`` matches exactly
+    and ``type!=value`` excludes exact matches. ``type`` must be one
+    of `SEARCH_TYPES`, or the whole word is searched for. Prefix a term with
+    ``!`` to negate it. Words without a type match ``any`` tag.
+
+    Bare words are added to the value of the preceding term (so
+    ``type: value`` is the same as ``type:value``). A value
+    in double quotes may contain spaces and colons, and ends the term.
+    Backslash escapes quotes and colons.
+    """
+    terms = []
+    joinable = False  # whether a bare word extends the last term
+    i = 0
+    while i < len(query):
+        if query[i].isspace():
+            i += 1
+            continue
+
+        m = _match_type(query, i)
+        if m and m.group(2).lower() not in SEARCH_TYPES:
+            m = None  # e.g. "E=MC2" is a word, not a term
+
+        if m:
+            neg, typ, op = m.groups()
+            i = m.end()
+
+        v = _match_value(query, i)
+        i = v.end()
+        quoted, bare = v.groups()
+        value = _unescape(quoted if quoted is not None else bare)
+
+        if m:
+            terms.append(Term(typ, op != ':', bool(neg) != (op == '!='),
+                              value))
+        elif joinable:  # e.g. after "artist: "
+            t = terms[-1]
+            if t.value:
+                value = u'{} {}'.format(t.value, value)
+            terms[-1] = t._replace(value=value)
         else:
-            pairs.append((None, word))
+            terms.append(Term(u'any', False, False, value))
+
+        joinable = quoted is None
+
+    terms = terms or [Term(u'any', False, False, u'')]
+    log.debug('query=%r, terms=%r', query, terms)
+    return terms
+
+
+def query_term(typ, value):
+    """Return a query term that matches ``value`` of ``typ``."""
+    value = value.replace(u'\\', u'\\\\').replace(u'"', u'\\"')
+    return u'{}:"{}"'.format(typ, value)
+
 
+def _positional(terms):
+    """Return the type & query pairs (for older MPDs) for ``terms``.
+
+    Negated terms can't be expressed, so are left out.
+    """
     args = []
-    typ = None
-    q = u''
-    for t, w in pairs:
-        if t:
-            if q:
-                args.append(q)
-                q = u''
-
-            args.append(t)
-            typ = t
-
-        elif not typ:
-            args.append('any')
-            typ = 'any'
-
-        q = u'{} {}'.format(q, w).strip()
-        # args.append(w)
-    args.append(q)
-
-    log.debug('query=%r, mpc=%r', query, args)
+    for t in terms:
+        if not t.negated:
+            args.extend((t.type, t.value))
+
     return args
 
 
-def search(query):
-    """Retrieve matching tracks."""
-    args = _parse_query(query)
-    return mpctracks('search', args)
+def _filter_string(value):
+    """Quote and escape ``value`` for a filter expression."""
+    value = value.replace(u'\\', u'\\\\').replace(u"'", u"\\'")
+    return u"'{}'".format(value)
+
+
+def _filter_expression(terms, command='search'):
+    """Compile ``terms`` into an MPD filter expression (MPD 0.21+)."""
+    parts = []
+    for t in terms:
+        value = _filter_string(t.value)
+        negated = t.negated
+        if t.type.lower() in _NOT_KEYS:
+            expr = u'({} {})'.format(t.type, value)
+        elif t.exact or command == 'find':
+            op = u'!=' if negated else u'=='
+            expr = u'({} {} {})'.format(t.type, op, value)
+            negated = False
+        else:
+            expr = u'({} contains {})'.format(t.type, value)
+
+        parts.append(u'(!{})'.format(expr) if negated else expr)
+
+    if len(parts) == 1:
+        return parts[0]
+
+    return u'({})'.format(u' AND '.join(parts))
+
+
+def _search_index(args, exact=False, offset=0, limit=0, sort=None):
+    """Search library index.
+
+    Returns songs as dicts or `None` if the index can't answer the query.
+    """
+    from .index import LibraryIndex
+    return LibraryIndex(INDEX_PATH).search(args, exact, limit, offset, sort)
+
+
+def _server_version():
+    """Return version of MPD protocol as a tuple of ints."""
+    return tuple(int(n) for n in client().version.split('.') if n.isdigit())
+
+
+def _search(command, query, offset=0, limit=None, sort=None):
+    """Run search-type ``command`` for ``query``."""
+    return search_results(query, command=command, offset=offset,
+                          limit=limit, sort=sort).tracks
+
+
+# Keys of parsed songs that aren't tags, so aren't matched by ``any``
+_NOT_TAGS = {u'file', u'last-modified', u'added', u'format', u'time',
+             u'duration', u'range', u'pos', u'id', u'prio'}
+
+# Search types that aren't keys of parsed songs
+_NOT_KEYS = {u'base', u'modified-since', u'added-since'}
+
+
+def _fold(s):
+    """Lowercase ``s`` for comparison.
+
+    Diacritics are kept, as MPD's ``search`` only ignores case.
+    """
+    return s.lower()
+
+
+def _refinable(previous, command, terms, sort):
+    """Whether results for ``terms`` are a subset of ``previous``."""
+    if (previous is None or not previous.complete or
+            command != 'search' or previous.command != command or
+            sort != previous.sort or len(terms) != len(previous.terms)):
+        return False
+
+    for t, p in zip(terms, previous.terms):
+        if (t.type, t.exact, t.negated) != (p.type, p.exact, p.negated):
+            return False
+
+        # only a longer substring narrows a search
+        if t.exact or t.negated:
+            if _fold(p.value) != _fold(t.value):
+                return False
+        elif _fold(p.value) not in _fold(t.value):
+            return False
+
+    return True
+
+
+def _matcher(terms, command='search'):
+    """Return a function that tests a song dict against ``terms``.
+
+    Returns `None` if a term can't be tested locally.
+    """
+    fold = _fold if command == 'search' else lambda s: s
+    tests = []
+    for t in terms:
+        typ = t.type.lower()
+        if typ in _NOT_KEYS:
+            return None
+
+        tests.append((typ, t.exact or command == 'find', t.negated,
+                      fold(t.value)))
+
+    def matches(d):
+        """Whether song ``d`` matches all terms."""
+        for typ, exact, negated, value in tests:
+            if typ == 'any':
+                values = [v for k, tag in d.items() if k not in _NOT_TAGS
+                          for v in _all(tag)]
+            else:
+                values = _all(d.get(typ, u''))
+
+            if exact:
+                found = any(value == fold(v) for v in values)
+            else:
+                found = any(value in fold(v) for v in values)
+
+            if found == negated:
+                return False
+
+        return True
+
+    return matches
+
+
+def _refine(songs, terms):
+    """Filter ``songs`` like MPD's ``search`` does.
+
+    Returns `None` if the songs can't be filtered by a type.
+    """
+    matches = _matcher(terms)
+    if matches is None:
+        return None
+
+    return [d for d in songs if matches(d)]
+
+
+def _local_terms(terms, command):
+    """Return ``terms`` the positional form can't express."""
+    local = [t for t in terms
+             if t.negated or (t.exact and command == 'search')]
+    if local and _matcher(local, command) is None:
+        log.warning("can't filter results by %r", local)
+        local = [t for t in local if t.type.lower() not in _NOT_KEYS]
+
+    return local
+
 
+def _positional_search(command, terms):
+    """Return search command & type and query pairs for ``terms``.
 
-def find(query):
-    """Retrieve *exactly* matching tracks."""
-    args = _parse_query(query)
-    return mpctracks('find', args)
+    Older MPDs, `mpc` and the index only understand type & query
+    pairs. Terms those can't express must be checked by the caller.
+
+    Returns:
+        tuple: ``(command, args, local)`` where ``local`` are the
+            terms the caller must check.
+    """
+    args = _positional(terms)
+    local = _local_terms(terms, command)
+    if not args:  # only negated terms: fetch everything
+        return 'search', [u'any', u''], local
+
+    return command, args, local
+
+
+def _search_options(args, local, offset, stop, sort, version):
+    """Add the paging & sorting options MPD ``version`` supports to ``args``.
+
+    Returns:
+        tuple: ``(args, skip, stop)``. Results ``skip`` to ``stop`` of
+            MPD's response are the requested page.
+    """
+    options = []
+    if sort:
+        if version >= (0, 21):
+            options.extend(['sort', sort])
+        else:
+            log.debug("MPD %s can't sort results",
+                      '.'.join(str(n) for n in version))
+
+    # results filtered here must be paged here
+    if stop and version >= (0, 20) and not local:
+        options.extend(['window', '{}:{}'.format(offset, stop)])
+        return args + options, 0, stop - offset
+
+    return args + options, offset, stop
+
+
+def search_results(query, previous=None, command='search', offset=0,
+                   limit=None, sort=None):
+    """Search for ``query``.
+
+    If ``previous`` results are complete and ``query`` narrows their
+    query (e.g. ``radioh`` after ``radio``), they are filtered locally
+    instead of searching again.
+
+    Paging and sorting are done by MPD (via the ``window`` and ``sort``
+    options) if it's new enough, so only one page is transferred.
+
+    Args:
+        query (unicode): Search query.
+        previous (Results): Results of previous search.
+        command (str): ``search`` or ``find``.
+        offset (int): Number of results to skip.
+        limit (int): Maximum number of results. Default is
+            `MAX_RESULTS`. 0 means no limit.
+        sort (str): Tag to sort results by. Prefix with ``-`` to sort
+            in descending order. Requires MPD 0.21 (or the index).
+
+    Returns:
+        Results: A page of results.
+    """
+    terms = _parse_query(query)
+    if limit is None:
+        limit = MAX_RESULTS
+
+    if not offset and _refinable(previous, command, terms, sort):
+        songs = _refine(previous.songs, terms)
+        if songs is not None:
+            log.debug('refined %d result(s) to %d for %r',
+                      len(previous.songs), len(songs), terms)
+            return Results(command, terms, sort, 0, songs, False, True)
+
+    # Fetch one result more than requested to find out if there are more
+    stop = offset + limit + 1 if limit else None
+
+    def page(songs, refinable=True):
+        """Return `Results` for ``songs`` (up to ``limit + 1``)."""
+        more = bool(limit) and len(songs) > limit
+        return Results(command, terms, sort, offset, songs[:limit or None],
+                       more, refinable and not offset and not more)
+
+    fetch, args, local = _positional_search(command, terms)
+
+    if INDEX_PATH and not local:
+        songs = _search_index(args, fetch == 'find', offset,
+                              stop - offset if stop else 0, sort)
+        if songs is not None:
+            # the index is fast enough to not bother refining
+            return page(songs, False)
+
+    if BACKEND == 'mpc':
+        if sort:
+            log.debug("mpc backend can't sort results")
+
+        # results only contain the tags in `Track`, so can't be refined
+        tracks = mpctracks(fetch, args, 0)
+        try:
+            songs = (t._asdict() for t in tracks)
+            if local:
+                matches = _matcher(local, command)
+                songs = (d for d in songs if matches(d))
+
+            songs = list(itertools.islice(songs, offset, stop))
+        finally:
+            tracks.close()
+
+        return page(songs, False)
+
+    version = _server_version()
+    if version >= (0, 21):
+        fetch, args, local = command, [_filter_expression(terms, command)], []
+
+    args, skip, stop = _search_options(args, local, offset, stop, sort,
+                                       version)
+    pairs = mpditer(fetch, args)
+    try:
+        songs = _iter_song_dicts(pairs, 0)
+        if local:
+            matches = _matcher(local, command)
+            songs = (d for d in songs if matches(d))
+
+        songs = list(itertools.islice(songs, skip, stop))
+    except CommandFailed as err:
+        raise _invalid_type(err, terms)
+    finally:
+        pairs.close()
+
+    return page(songs)
+
+
+def search(query, offset=0, limit=None, sort=None):
+    """Retrieve matching tracks.
+
+    See `search_results` for ``offset``, ``limit`` and ``sort``.
+    """
+    return _search('search', query, offset, limit, sort)
+
+
+def find(query, offset=0, limit=None, sort=None):
+    """Retrieve *exactly* matching tracks.
+
+    See `search_results` for ``offset``, ``limit`` and ``sort``.
+    """
+    return _search('find', query, offset, limit, sort)
 
 
 def types():
     """Fetch list of valid search types."""
-    # mpc doesn't appear to provide a list, so provoke an
-    # InvalidType error by sending an invalid type.
-    try:
-        search('whereverwhenever:shakira!')
-    except InvalidType as exc:
-        return exc.valid
+    if BACKEND == 'mpc':
+        # mpc doesn't appear to provide a list, so provoke an
+        # InvalidType error by sending an invalid type.
+        try:
+            mpc('search', ['whereverwhenever', 'shakira!'])
+        except InvalidType as exc:
+            return exc.valid
+
+    return _parse_types(mpd('tagtypes'))
+
+
+def _parse_types(pairs):
+    """Parse response to ``tagtypes`` into search types."""
+    tags = [t.lower() for t in _values(pairs, 'tagtype')]
+    return tuple(['any', 'file'] + tags)
+
+
+def _parse_stats(pairs):
+    """Parse response to ``stats`` command."""
+    d = {k: v for k, v in pairs}
+    return Stats(*[int(d.get(k, 0)) for k in Stats._fields])
 
 
 def stats():
     """Fetch statistics about MPD library."""
+    if BACKEND != 'mpc':
+        return _parse_stats(mpd('stats'))
+
     artists = 0
     albums = 0
     songs = 0
@@ -309,15 +1736,29 @@ def _parse_status(out):
 
         elif DELIMITER in line:  # current track
             # log.debug('current track: %r', line)
-            cur = _parse_track_list(line)[0]
+            cur = _parse_track(line)
             log.debug('current track=%r', cur)
 
     return Status(cur, mode == 'playing', pos, count, volume)
 
 
+def _list(tag, query=None):
+    """List/search values of ``tag`` via MPD protocol."""
+    if query:
+        return _values(mpd('search', [tag, query]), tag)
+
+    return _values(mpd('list', [tag]), tag)
+
+
 def artists(query=None):
     """List/search artists."""
     artists = OrderedDict()
+    if BACKEND != 'mpc':
+        for name in _list('artist', query):
+            artists[name] = True
+
+        return artists.keys()
+
     if query:
         out = mpc('search',
                   ['artist', query],
@@ -340,6 +1781,12 @@ def artists(query=None):
 def albums(query=None):
     """List/search all artists."""
     albums = OrderedDict()
+    if BACKEND != 'mpc':
+        for name in _list('album', query):
+            albums[name] = True
+
+        return albums.keys()
+
     if query:
         out = mpc('search',
                   ['album', query],
@@ -359,30 +1806,376 @@ def albums(query=None):
     return albums.keys()
 
 
+def tag_values(tags):
+    """List values of each of ``tags``.
+
+    Uses a single exchange with MPD (except for the `mpc` backend).
+
+    Returns:
+        list: A list of distinct values for each tag.
+    """
+    if BACKEND == 'mpc':
+        return [[v for v in mpc('list', [tag]).split('\n') if v]
+                for tag in tags]
+
+    return [_values(r, tag)
+            for tag, r in zip(tags, mpdlist([('list', [t]) for t in tags]))]
+
+
+def read_board():
+    """Return status, current track and queue length from status board.
+
+    Returns:
+        tuple: ``(Status, Track, queue length)`` or `None` if
+            `STATUS_BOARD` isn't set or the board is out of date.
+            The track is `None` if there's no current track.
+    """
+    if not STATUS_BOARD:
+        return None
+
+    from .board import StatusBoard
+    board = StatusBoard(STATUS_BOARD).read()
+    if board is None:
+        log.debug('status board is out of date')
+        return None
+
+    st, track = board
+    return (_parse_mpd_status(st.items(), track), track,
+            st[u'playlistlength'])
+
+
 def status():
     """Retrieve MPD status inc. playing/paused and volume."""
-    out = mpc('status', opts=('--format', RESULT_FORMAT))
-    return _parse_status(out)
+    if BACKEND == 'mpc':
+        out = mpc('status', opts=('--format', RESULT_FORMAT))
+        return _parse_status(out)
+
+    board = read_board()
+    if board is not None:
+        return board[0]
+
+    st, song = mpdlist([('status', None), ('currentsong', None)])
+    tracks = _parse_songs(song)
+    return _parse_mpd_status(st, tracks[0] if tracks else None)
+
+
+def snapshot():
+    """Fetch player status, queue summary & library stats at once.
+
+    Uses a single exchange with MPD. With the `mpc` backend, the calls
+    run in parallel on a `WorkerPool`.
+
+    Returns:
+        Snapshot: Immutable state of MPD.
+    """
+    if BACKEND == 'mpc':
+        # each call runs `mpc`, so run them side by side
+        funcs = (status, queue, stats, playlists, types)
+        with WorkerPool(len(funcs)) as pool:
+            calls = [pool.submit(f) for f in funcs]
+
+        st, queued, stp, pls, tags = [c.result() for c in calls]
+        return Snapshot(st, st.track, len(queued), stp, tuple(pls), tags, 0)
+
+    st, song, stp, pls, tags = mpdlist([
+        ('status', None),
+        ('currentsong', None),
+        ('stats', None),
+        ('listplaylists', None),
+        ('tagtypes', None),
+    ])
+    tracks = _parse_songs(song)
+    length = int(dict(st).get(u'playlistlength', 0))
+    st = _parse_mpd_status(st, tracks[0] if tracks else None)
+
+    return Snapshot(st, st.track, length,
+                    _parse_stats(stp), tuple(_values(pls, 'playlist')),
+                    _parse_types(tags), _parse_db_update(stp))
+
+
+def _parse_db_update(pairs):
+    """Return ``db_update`` from response to ``stats``."""
+    return int(dict(pairs).get(u'db_update', 0))
+
+
+def db_update():
+    """Return time the MPD database was last updated.
+
+    Always 0 for the `mpc` backend.
+    """
+    if BACKEND == 'mpc':
+        return 0
+
+    return _parse_db_update(mpd('stats'))
+
+
+_LSINFO_TYPES = (u'file', u'directory', u'playlist')
+
+
+def library(batch_size=50):
+    """Generate all songs and directories in the library as dicts.
+
+    Keys are lowercase tag names, plus ``file`` for songs and
+    ``directory`` for directories. The library is walked with
+    ``lsinfo``, ``batch_size`` directories per exchange, so no
+    response is larger than a few directories' worth of songs
+    (``listallinfo`` can exceed MPD's output buffer limit).
+    """
+    pending = [u'']
+    while pending:
+        paths = pending[:batch_size]
+        pending = pending[batch_size:]
+        for objs in lsinfo(paths):
+            for d in objs:
+                if u'directory' in d:
+                    pending.append(d['directory'])
+                    yield d
+                elif u'file' in d:
+                    yield d
+
+
+def lsinfo(paths):
+    """List contents of several directories in one exchange.
+
+    Args:
+        paths (list): Directories to list. ``""`` is the root.
+
+    Returns:
+        list: A list of dicts for each directory (see `library`).
+    """
+    return [_parse_objects(r, _LSINFO_TYPES)
+            for r in mpdlist([('lsinfo', [p]) for p in paths])]
+
+
+def modified_since(timestamp):
+    """Return songs modified after Unix ``timestamp`` as dicts."""
+    return _parse_objects(mpd('find', ['modified-since', timestamp]))
+
+
+def updating():
+    """Whether MPD is updating its database."""
+    if BACKEND == 'mpc':
+        return u'Updating DB' in mpc('status')
+
+    return u'updating_db' in dict(mpd('status'))
+
+
+def idle(subsystems=None):
+    """Wait for changes in MPD subsystems.
+
+    Args:
+        subsystems (list): Subsystems to wait for, e.g. ``database``
+            or ``player``. Wait for any change if empty.
+
+    Returns:
+        list: Names of changed subsystems.
+    """
+    c = client()
+    c.settimeout(None)
+    try:
+        return _values(c.command('idle', subsystems), 'changed')
+    finally:
+        if c.connected:
+            c.settimeout(c.timeout)
+
+
+def wait_for_update():
+    """Block until MPD has finished updating its database."""
+    while updating():
+        log.debug('waiting for database update to finish ...')
+        idle(['update'])
 
 
 def queue():
-    """Retrieve tracks in queue."""
-    return mpctracks('playlist')
+    """Retrieve tracks in queue as a `TrackStore`."""
+    if BACKEND == 'mpc':
+        return TrackStore(mpctracks('playlist'))
+
+    return TrackStore(mpdtracks('playlistinfo'))
+
+
+# Maximum number of new songs whose files `QueueIndex` looks up one
+# by one. With more, the files of the whole queue are fetched.
+QUEUE_LOOKUP_MAX = 100
+
+
+class QueueIndex(object):
+    """Positions and song IDs of the files in the queue.
+
+    Updated with ``plchangesposid``, which only lists the songs that
+    have changed since the queue version the index was made from,
+    so updating an index kept between runs (e.g. pickled) is cheap
+    however long the queue is. The `mpc` backend always fetches the
+    whole queue, and uses positions as song IDs.
+    """
+
+    def __init__(self):
+        """Create new, empty index. Call `update` to fill it."""
+        self.version = None  # MPD's playlist version
+        self.started = None  # when MPD was started
+        self.ids = []  # song ID at each position
+        self.positions = {}  # song ID -> position
+        self.files = {}  # song ID -> file
+        self.songs = {}  # file -> set of song IDs
+
+    def __len__(self):
+        """Number of songs in queue."""
+        return len(self.ids)
+
+    def __contains__(self, path):
+        """Whether file ``path`` is in the queue."""
+        return path in self.songs
+
+    def find(self, path):
+        """Return sorted ``(position, songid)`` of file ``path`` in queue.
+
+        Positions are 0-based.
+        """
+        return sorted((self.positions[i], i) for i in self.songs.get(path, ()))
+
+    def update(self):
+        """Apply changes to the queue since index was last updated.
+
+        Returns:
+            QueueIndex: The index.
+        """
+        if BACKEND == 'mpc':
+            self.__init__()
+            files = dict(enumerate(t.file for t in queue()))
+            self._apply(len(files), [(p, p) for p in files], None, files)
+            return self
+
+        while True:
+            st, stats, changes = mpdlist([
+                ('status', None),
+                ('stats', None),
+                ('plchangesposid', [self.version or 0]),
+            ])
+            st = dict(st)
+            version = int(st[u'playlist'])
+            started = time.time() - int(dict(stats).get(u'uptime', 0))
+            if self.version is not None and (
+                    abs(started - self.started) > 5 or version < self.version):
+                log.debug('[queue] MPD was restarted, rebuilding index')
+                self.__init__()
+                continue
+
+            self.started = started
+            if version == self.version:
+                return self
+
+            changes = [(int(d[u'cpos']), int(d[u'id']))
+                       for d in _iter_objects(changes, (u'cpos',))]
+            files = self._fetch_files(version, changes)
+            if files is not None:
+                break
+
+            log.debug('[queue] queue changed during update, trying again')
+
+        self._apply(int(st.get(u'playlistlength', 0)), changes, version,
+                    files)
+        return self
+
+    def _fetch_files(self, version, changes):
+        """Return files of songs in ``changes`` not in index.
+
+        Returns `None` if the queue is no longer at ``version``.
+        """
+        new = [(p, i) for p, i in changes if i not in self.files]
+        if not new:
+            return {}
+
+        if len(new) > QUEUE_LOOKUP_MAX:
+            st, pairs = mpdlist([('status', None), ('playlist', None)])
+            queued = {}
+            for key, value in pairs:  # keys are "<pos>:file"
+                queued[int(key.split(u':', 1)[0])] = value
+            files = {i: queued.get(p) for p, i in new}
+        else:
+            try:
+                responses = mpdlist([('status', None)] +
+                                    [('playlistid', [i]) for _, i in new])
+            except CommandFailed:  # song removed meanwhile
+                return None
+
+            st = responses[0]
+            files = {}
+            for pairs in responses[1:]:
+                for d in _iter_objects(pairs):
+                    files[int(d[u'id'])] = d[u'file']
+
+        if int(dict(st)[u'playlist']) != version:
+            return None
+
+        return files
+
+    def _apply(self, length, changes, version, files):
+        """Put songs in ``changes`` at their new positions.
+
+        Args:
+            length (int): New length of queue.
+            changes (list): ``(position, songid)`` of changed songs.
+            version (int): New playlist version.
+            files (dict): Files of songs not yet in index.
+        """
+        ids = self.ids
+        displaced = set(ids[length:])
+        del ids[length:]
+        ids.extend([None] * (length - len(ids)))
+
+        placed = set()
+        for pos, songid in changes:
+            old = ids[pos]
+            if old is not None and old != songid:
+                displaced.add(old)
+
+            ids[pos] = songid
+            self.positions[songid] = pos
+            placed.add(songid)
+            if songid not in self.files:
+                path = files[songid]
+                self.files[songid] = path
+                self.songs.setdefault(path, set()).add(songid)
+
+        for songid in displaced - placed:
+            path = self.files.pop(songid)
+            del self.positions[songid]
+            self.songs[path].discard(songid)
+            if not self.songs[path]:
+                del self.songs[path]
+
+        self.version = version
+        log.debug('[queue] %d change(s) to queue version %s, %d songs',
+                  len(changes), version, len(ids))
 
 
 def clear():
     """Clear queue."""
-    mpc('clear')
+    if BACKEND == 'mpc':
+        mpc('clear')
+    else:
+        _run('clear')
 
 
 def update():
     """Rescan media for changes."""
-    mpc('update')
+    if BACKEND == 'mpc':
+        mpc('update')
+    else:
+        _run('update')
 
 
 def current():
     """Fetch current track."""
-    tracks = mpctracks('current')
+    if BACKEND == 'mpc':
+        tracks = list(mpctracks('current'))
+    else:
+        board = read_board()
+        if board is not None:
+            return board[1]
+
+        tracks = list(mpdtracks('currentsong'))
+
     if not tracks:
         return None
 
@@ -394,8 +2187,34 @@ def playing():
     return status().playing
 
 
+def albumart(track):
+    """Fetch cover art for `Track` as bytes.
+
+    Returns ``None`` if there is no cover or the `mpc` backend
+    is used.
+    """
+    if BACKEND == 'mpc':
+        return None
+
+    try:
+        return client().binary('albumart', track.file) or None
+    except CommandFailed as err:
+        if err.code == ACK_ERROR_NO_EXIST:
+            return None
+        raise
+
+
 def playpause():
     """Start/stop playback."""
+    if BACKEND != 'mpc':
+        if playing():
+            _run('pause', ['1'])
+            log.info('playback paused')
+        else:
+            _run('play')
+            log.info('playback started')
+        return
+
     if playing():
         mpc('pause')
         log.info('playback paused')
@@ -409,20 +2228,97 @@ def playpause():
 
 
 def play(index=None):
-    """Start playback."""
+    """Start playback.
+
+    ``index`` is the 1-based position of the track in the queue.
+    """
+    if BACKEND != 'mpc':
+        _run('play', [index - 1] if index else [])
+        log.info('playback started')
+        return None if _active_batch() else status()
+
     args = [index] if index else []
     out = mpc('play', args)
     log.info('playback started')
     return _parse_status(out)
 
 
+def play_track(track, index=None):
+    """Play a `Track`, adding it to the end of the queue if necessary.
+
+    The track's songs are looked up in ``index`` if it's an up-to-date
+    `QueueIndex`, else with ``playlistfind``. A queued song is played
+    by ID. Otherwise the track is added with ``addid`` at the position
+    after the last song, and that position played, in one command
+    list. If the queue has been shortened meanwhile, ``addid`` fails
+    and nothing is played.
+
+    In a `Batch` that clears the queue, the track is added without
+    looking it up. Other changes to the queue in the batch are sent
+    before the track is looked up.
+
+    Returns:
+        int: Song ID of the track. `None` for the `mpc` backend, or
+            if the track is added in a `Batch` (its ID is unknown
+            until the batch is sent).
+    """
+    b = _active_batch() if BACKEND != 'mpc' else None
+    if b is not None and b.changes_queue and not b.cleared:
+        b.send()
+        if index is not None:  # out of date now
+            index.update()
+
+    if b is not None and b.cleared:
+        found, length = [], 0
+    elif index is None and BACKEND != 'mpc':
+        pairs, st = mpdlist([('playlistfind', ['file', track.file]),
+                             ('status', None)])
+        found = [(int(d[u'pos']), int(d[u'id']))
+                 for d in _iter_objects(pairs)]
+        length = int(dict(st).get(u'playlistlength', 0))
+    else:
+        if index is None:
+            index = QueueIndex().update()
+        found = index.find(track.file)
+        length = len(index)
+
+    if BACKEND == 'mpc':
+        if not found:
+            queue_track(track)
+        mpc('play', [found[0][0] + 1 if found else length + 1])
+        log.info('playing track: %s', track.file)
+        return None
+
+    if found:
+        songid = found[0][1]
+        _run('playid', [songid])
+    else:
+        with batch() as added:
+            _run('addid', [track.file, length])
+            _run('play', [length])
+        songid = None
+        if b is None:  # ``added`` was sent on exit
+            songid = int(dict(added.results[0])[u'Id'])
+
+    log.info('playing track: %s', track.file)
+    return songid
+
+
 def play_playlist(name):
     """Play a playlist."""
-    mpc('load', [name])
+    if BACKEND == 'mpc':
+        mpc('load', [name])
+    else:
+        _run('load', [name])
 
 
 def stop():
     """Stop playback."""
+    if BACKEND != 'mpc':
+        _run('stop')
+        log.info('playback stopped')
+        return None if _active_batch() else status()
+
     out = mpc('stop')
     log.info('playback stopped')
     return _parse_status(out)
@@ -430,40 +2326,187 @@ def stop():
 
 def queue_track(track):
     """Add a `Track` to the queue."""
-    mpc('add', (track.file,))
+    if BACKEND == 'mpc':
+        mpc('add', (track.file,))
+    else:
+        _run('add', (track.file,))
     log.info('track queued: %s', track.file)
 
 
-def remove_track(track):
-    """Remove a `Track` from the queue."""
-    idx = 0
-    for i, t in enumerate(queue()):
-        idx += 1
-        if t.file == track.file:
-            mpc('del', (idx,))
-            idx -= 1
-            log.info('track removed: %s', track.file)
+def queue_query(query, exact=True, position=None):
+    """Add all tracks matching ``query`` to the queue.
+
+    Uses MPD's ``findadd`` (or ``searchadd`` if ``exact`` is `False`),
+    so the tracks are added by MPD without being sent to the workflow.
+    If MPD can't express the query (e.g. negated terms before MPD
+    0.21) or insert at ``position`` (before MPD 0.23), the query is
+    searched and the results added in one command list.
+
+    Args:
+        query (unicode): Search query (see `search_results`).
+        exact (bool): Match like `find` instead of `search`.
+        position (int): 0-based position in queue to insert tracks at.
+            Default is the end of the queue.
+
+    Returns:
+        int: Number of tracks queued. `None` if unknown (in a `Batch`
+            or with the `mpc` backend).
+    """
+    command = 'find' if exact else 'search'
+    terms = _parse_query(query)
+    args = _positional(terms)
+    local = _local_terms(terms, command)
+    if BACKEND == 'mpc':
+        if position is not None:
+            log.debug("mpc backend can't insert at a position")
+
+        if not local and args:
+            mpc(command + 'add', args)
+            log.info('queued results of %s %r', command, query)
+            return None
+    else:
+        version = _server_version()
+        if version >= (0, 21):
+            args, local = [_filter_expression(terms, command)], []
+
+        if not local and args and (position is None or version >= (0, 23)):
+            if position is not None:
+                args += ['position', u'{}'.format(position)]
+
+            log.info('queuing results of %s %r', command, query)
+            b = _active_batch()
+            if b is not None:
+                b.add(command + 'add', args)
+                return None
+
+            try:
+                before, _, after = mpdlist([('status', None),
+                                            (command + 'add', args),
+                                            ('status', None)])
+            except CommandFailed as err:
+                raise _invalid_type(err, terms)
+
+            return (int(dict(after).get(u'playlistlength', 0)) -
+                    int(dict(before).get(u'playlistlength', 0)))
+
+    files = [d[u'file'] for d in
+             search_results(query, command=command, limit=0).songs]
+    log.info('queuing %d result(s) of %s %r', len(files), command, query)
+    if BACKEND == 'mpc':
+        if files:
+            mpc('add', files)
+    else:
+        with batch():
+            for i, path in enumerate(files):
+                if position is None:
+                    _run('add', [path])
+                else:
+                    _run('addid', [path, position + i])
+
+    return len(files)
+
+
+def _ranges(positions):
+    """Collapse ``positions`` into sorted ``(start, end)`` ranges.
+
+    ``end`` is exclusive, like MPD's ``START:END`` ranges. Duplicate
+    positions are ignored.
+    """
+    ranges = []
+    for pos in sorted(set(positions)):
+        if ranges and ranges[-1][1] == pos:
+            ranges[-1][1] = pos + 1
+        else:
+            ranges.append([pos, pos + 1])
+
+    return [tuple(r) for r in ranges]
+
+
+def remove_track(track, index=None):
+    """Remove a `Track` from the queue (see `remove_tracks`)."""
+    return remove_tracks([track], index)
+
+
+def remove_tracks(tracks, index=None):
+    """Remove all songs of `Track`s from the queue.
+
+    The songs are looked up in ``index`` if it's an up-to-date
+    `QueueIndex`, else with one ``playlistfind`` per file. They are
+    removed in one exchange with MPD (one call to `mpc` for the `mpc`
+    backend): runs of adjacent songs as ``START:END`` ranges, single
+    songs by ID.
+
+    Returns:
+        int: Number of songs removed.
+    """
+    files = {t.file for t in tracks}
+    found = {}  # position -> song ID
+    if index is None and BACKEND != 'mpc':
+        files = sorted(files)
+        responses = mpdlist([('playlistfind', ['file', f]) for f in files])
+        for pairs in responses:
+            for d in _iter_objects(pairs):
+                found[int(d[u'pos'])] = d[u'id']
+    else:
+        if index is None:
+            index = QueueIndex().update()
+        for f in files:
+            found.update(index.find(f))
+
+    # from the end, so positions of the other songs don't change
+    ranges = _ranges(found)[::-1]
+    if BACKEND == 'mpc':
+        if ranges:
+            mpc('del', [u'{}-{}'.format(a + 1, b) if b - a > 1 else
+                        u'{}'.format(b) for a, b in ranges])
+    else:
+        with batch():
+            for a, b in ranges:
+                if b - a > 1:
+                    _run('delete', [u'{}:{}'.format(a, b)])
+                else:  # IDs don't change if the queue has been changed
+                    _run('deleteid', [found[a]])
+
+    log.info('removed %d song(s) of %d track(s) in %d range(s)',
+             len(found), len(files), len(ranges))
+    return len(found)
 
 
 def skip_next():
     """Go to next track."""
-    out = mpc('next')
-    log.debug('out=%r', out)
+    if BACKEND == 'mpc':
+        out = mpc('next')
+        log.debug('out=%r', out)
+    else:
+        _run('next')
     log.info('skipped to next track')
 
 
 def skip_previous():
     """Go to previous track."""
-    out = mpc('prev')
-    log.debug('out=%r', out)
+    if BACKEND == 'mpc':
+        out = mpc('prev')
+        log.debug('out=%r', out)
+    else:
+        _run('previous')
     log.info('skipped to previous track')
 
 
 def _setvol(v):
-    """Set volume to ``v``."""
-    out = mpc('volume', (v,))
-    st = _parse_status(out)
-    log.info('volume set to %d%%', st.volume)
+    """Set volume to ``v``.
+
+    ``v`` may be absolute (``"50"``) or relative (``"+10"``).
+    """
+    if BACKEND != 'mpc':
+        _run('volume' if v[0] in '+-' else 'setvol', (v,))
+        if _active_batch():
+            return None
+        st = status()
+    else:
+        out = mpc('volume', (v,))
+        st = _parse_status(out)
+
+    log.info('volume set to %s%%', st.volume)
     return st
 
 
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Typo-tolerant index of artist and album names.
+
+MPD's ``search`` only finds substrings, so a single typo ("radiohaed")
+returns nothing. `NameIndex` finds the names that a query nearly
+matches instead. It maps the trigrams of the distinct artist,
+albumartist and album names to the names containing them. The names
+that share the most trigrams with a query are ranked by how many
+edits turn the query into a substring of the name.
+
+The index is small enough to pickle into the workflow's cache and
+is only rebuilt when MPD's database changes.
+"""
+
+from __future__ import print_function, absolute_import
+
+import logging
+import time
+import unicodedata
+
+from . import mpd
+
+# Tags whose values are indexed
+TAGS = ('artist', 'albumartist', 'album')
+
+# Number of names (sharing the most trigrams with the query) whose
+# edit distance is worked out
+CANDIDATES = 100
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+def _normalise(s):
+    """Return lowercase ``s`` without diacritics."""
+    s = unicodedata.normalize('NFKD', s.lower())
+    return u''.join(c for c in s if not unicodedata.combining(c))
+
+
+def _trigrams(s):
+    """Return set of three-character substrings of ``s``."""
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def _max_distance(query):
+    """Return number of typos tolerated in ``query``."""
+    return max(1, len(query) // 4)
+
+
+def _distance(query, name, limit):
+    """Return edit distance of ``query`` to best substring of ``name``.
+
+    Insertions, deletions, substitutions and transpositions of adjacent
+    characters count as one edit. Characters of ``name`` before and
+    after the matching substring are free. Stops counting once the
+    distance must be greater than ``limit``.
+    """
+    # rows of distances for prefixes of `query` vs. substrings of `name`
+    # ending at each position
+    prev2 = None
+    prev = [0] * (len(name) + 1)
+    for i, qc in enumerate(query, 1):
+        row = [i]
+        for j, nc in enumerate(name, 1):
+            d = min(prev[j] + 1, row[j - 1] + 1,
+                    prev[j - 1] + (qc != nc))
+            if (prev2 is not None and j > 1 and qc == name[j - 2] and
+                    query[i - 2] == nc):
+                d = min(d, prev2[j - 2] + 1)
+            row.append(d)
+
+        if min(row) > limit:
+            return limit + 1
+
+        prev2, prev = prev, row
+
+    return min(prev)
+
+
+class NameIndex(object):
+    """Trigram index of tag values."""
+
+    def __init__(self, names, tags, postings):
+        """Create new index. Use `NameIndex.build` instead.
+
+        Args:
+            names (list): Names in the index.
+            tags (list): Tuple of tags each name is a value of.
+            postings (dict): Maps trigram to IDs of names containing it.
+        """
+        self.names = names
+        self.tags = tags
+        self.postings = postings
+
+    @classmethod
+    def build(cls, values):
+        """Return index of ``values``.
+
+        Args:
+            values (dict): Maps each of `TAGS` to its distinct values.
+        """
+        start = time.time()
+        ids = {}
+        names = []
+        tags = []
+        postings = {}
+        for tag in TAGS:
+            for name in values.get(tag, ()):
+                if not name:
+                    continue
+
+                i = ids.get(name)
+                if i is not None:
+                    if tag not in tags[i]:
+                        tags[i] += (tag,)
+                    continue
+
+                i = ids[name] = len(names)
+                names.append(name)
+                tags.append((tag,))
+                for gram in _trigrams(_normalise(name)):
+                    postings.setdefault(gram, []).append(i)
+
+        log.debug('[names] indexed %d names in %0.3fs',
+                  len(names), time.time() - start)
+        return cls(names, tags, postings)
+
+    @classmethod
+    def fetch(cls):
+        """Return index of the values of `TAGS` in MPD's library."""
+        return cls.build(dict(zip(TAGS, mpd.tag_values(TAGS))))
+
+    def similar(self, query, tags=TAGS, limit=0):
+        """Return names ``query`` nearly matches, best matches first.
+
+        Args:
+            query (unicode): Name (or part of one) with typos.
+            tags (sequence): Only return values of these tags.
+            limit (int): Maximum number of names. 0 means no limit.
+
+        Returns:
+            list: ``(name, tags, distance)`` tuples. ``tags`` are the
+                tags ``name`` is a value of and ``distance`` the
+                number of typos (see `_distance`).
+        """
+        start = time.time()
+        query = _normalise(query.strip())
+        grams = _trigrams(query)
+        if not grams:  # too short to have typos worth correcting
+            return []
+
+        tags = set(tags)
+        counts = {}
+        for gram in grams:
+            for i in self.postings.get(gram, ()):
+                counts[i] = counts.get(i, 0) + 1
+
+        # Each edit changes at most three trigrams
+        k = _max_distance(query)
+        need = max(1, len(grams) - 3 * k)
+        candidates = [i for i, n in counts.items()
+                      if n >= need and tags.intersection(self.tags[i])]
+        candidates.sort(key=lambda i: (-counts[i], i))
+        candidates = candidates[:CANDIDATES]
+
+        results = []
+        for i in candidates:
+            name = self.names[i]
+            norm = _normalise(name)
+            d = _distance(query, norm, k)
+            if d <= k:
+                results.append((d, abs(len(norm) - len(query)), name, i))
+
+        results.sort()
+        if limit:
+            results = results[:limit]
+
+        log.debug('[names] %d name(s) like %r (of %d candidates) in %0.3fs',
+                  len(results), query, len(candidates), time.time() - start)
+        return [(name, self.tags[i], d) for d, _, name, i in results]
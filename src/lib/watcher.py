@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Watch MPD for changes.
+
+The watcher sits in MPD's ``idle`` command and counts the changes to
+each subsystem. The counters are saved to a small JSON file, so a
+cache can tell whether it's stale by reading a file instead of asking
+MPD. When the player, mixer or queue change, it also updates the
+status board (see `board.py`).
+
+The watcher runs in a thread of the broker daemon. Its files are
+deleted when the broker exits, and the counters start from zero
+in a new "session" each time the broker is started.
+"""
+
+from __future__ import print_function, absolute_import
+
+import json
+import logging
+import os
+import time
+
+from . import mpd
+from .board import StatusBoard, board_path
+from .workflow.util import atomic_writer
+
+# MPD subsystems to count changes to
+SUBSYSTEMS = ('database', 'playlist', 'player', 'mixer', 'options',
+              'stored_playlist')
+
+# Subsystems whose changes are shown on the status board
+BOARD_SUBSYSTEMS = ('player', 'mixer', 'playlist')
+
+# Seconds to wait before reconnecting to MPD
+RETRY_DELAY = 5
+
+log = logging.getLogger('workflow.{}'.format(__name__))
+
+
+def changes_path(dirpath):
+    """Return path of counters file in directory ``dirpath``."""
+    return os.path.join(dirpath, 'changes.json')
+
+
+def read_changes(path):
+    """Return counters saved by watcher at ``path``.
+
+    Returns:
+        dict: ``session`` and a counter for each of `SUBSYSTEMS`, or
+            `None` if there are no (valid) counters.
+    """
+    try:
+        with open(path) as fp:
+            return json.load(fp)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+class Watcher(object):
+    """Count changes to MPD subsystems."""
+
+    def __init__(self, dirpath):
+        """Create new watcher that saves its files in ``dirpath``."""
+        self.path = changes_path(dirpath)
+        self.board = StatusBoard(board_path(dirpath))
+        self.session = time.time()
+        self.counters = dict.fromkeys(SUBSYSTEMS, 0)
+
+    def run(self):
+        """Wait for changes forever."""
+        self.remove()  # left over by a broker that crashed
+        while True:
+            c = mpd.Client()
+            try:
+                c.connect()
+            except mpd.MPDError as err:  # incl. wrong password
+                log.debug('[watcher] %s: %s', err.msg, err.reason)
+                c.close()
+                time.sleep(RETRY_DELAY)
+                continue
+
+            try:
+                # anything may have changed while we weren't connected
+                changed = SUBSYSTEMS
+                while True:
+                    if set(changed) & set(BOARD_SUBSYSTEMS):
+                        self._update_board(c)
+
+                    self._changed(changed)
+                    c.settimeout(None)
+                    pairs = c.command('idle', SUBSYSTEMS)
+                    c.settimeout(c.timeout)
+                    changed = [v for k, v in pairs if k == 'changed']
+            except mpd.MPDError as err:
+                log.debug('[watcher] lost connection to MPD: %s', err)
+                c.close()
+                self.board.remove()  # status unknown until reconnected
+                time.sleep(RETRY_DELAY)
+            except Exception:
+                # e.g. files can't be written. Delete them, so nothing
+                # trusts stale counters, and start over.
+                log.exception('[watcher] error')
+                c.close()
+                try:
+                    self.remove()
+                except (IOError, OSError) as err:
+                    log.error("[watcher] couldn't delete files: %s", err)
+                time.sleep(RETRY_DELAY)
+
+    def remove(self):
+        """Delete counters file and status board."""
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+        self.board.remove()
+
+    def _update_board(self, c):
+        """Fetch status and current track and put them on the board."""
+        fetched = time.time()
+        st, song = c.command_list([('status', None), ('currentsong', None)])
+        tracks = mpd._parse_songs(song)
+        self.board.write(dict(st), tracks[0] if tracks else None, fetched)
+
+    def _changed(self, subsystems):
+        """Increment counters of ``subsystems`` and save them."""
+        for name in subsystems:
+            if name in self.counters:
+                self.counters[name] += 1
+
+        data = dict(self.counters, session=self.session)
+        with atomic_writer(self.path, 'wb') as fp:
+            json.dump(data, fp)
+
+        log.debug('[watcher] changed: %s', ', '.join(subsystems))
@@ -48,6 +48,8 @@ from .workflow import (
 
 # Filter matching rules
 from .workflow import (
+    CompiledQuery,
+    FilterIndex,
     MATCH_ALL,
     MATCH_ALLCHARS,
     MATCH_ATOM,
@@ -96,6 +98,8 @@ __all__ = [
     'ICON_USER',
     'ICON_WARNING',
     'ICON_WEB',
+    'CompiledQuery',
+    'FilterIndex',
     'MATCH_ALL',
     'MATCH_ALLCHARS',
     'MATCH_ATOM',
@@ -23,6 +23,9 @@ from __future__ import print_function, unicode_literals
 
 import binascii
 import cPickle
+import hashlib
+import heapq
+import itertools
 from copy import deepcopy
 import json
 import logging
@@ -415,6 +418,28 @@ INITIALS = string.ascii_uppercase + string.digits
 #: Split on non-letters, numbers
 split_on_delimiters = re.compile('[^a-zA-Z0-9]').split
 
+# Characters that have their own bit in the character masks of
+# search keys. All other characters share the last bit.
+_MASK_CHARS = (string.ascii_lowercase + string.digits +
+               ' !"#$%&\'()*+,-./:;<=>?@[]_~')
+_CHAR_BITS = dict((c, 1 << i) for i, c in enumerate(_MASK_CHARS))
+_OTHER_CHARS_BIT = 1 << len(_MASK_CHARS)
+
+# Minimum number of items for :class:`FilterIndex` to screen items
+# with NumPy (if it's installed). Importing NumPy takes longer than
+# screening fewer items one by one.
+_NUMPY_MIN_ITEMS = 100000
+
+# Minimum number of items for :class:`FilterIndex` to use worker
+# processes (if asked to). Starting them takes longer than filtering
+# fewer items in one process.
+_PARALLEL_MIN_ITEMS = 20000
+
+# :class:`FilterIndex` being filtered by worker processes. The workers
+# are forked after it is set, so they inherit it instead of having the
+# items sent to them.
+_pool_index = None
+
 # Match filter flags
 #: Match items that start with ``query``
 MATCH_STARTSWITH = 1
@@ -437,6 +462,499 @@ MATCH_ALLCHARS = 64
 MATCH_ALL = 127
 
 
+def _allchars_search(query):
+    """Return search function for :const:`MATCH_ALLCHARS`.
+
+    The pattern matches all characters in ``query`` in the same order.
+    """
+    pattern = []
+    for c in query:
+        # pattern.append('[^{0}]*{0}'.format(re.escape(c)))
+        pattern.append('.*?{0}'.format(re.escape(c)))
+    pattern = ''.join(pattern)
+    return re.compile(pattern, re.IGNORECASE).search
+
+
+class CompiledQuery(object):
+    """Query for :meth:`Workflow.filter`, pre-processed for matching.
+
+    Pass one to :meth:`Workflow.filter` instead of a string to reuse
+    the processed query for several sets of items.
+
+    :param query: query to test items against
+    :type query: ``unicode``
+
+    """
+
+    def __init__(self, query):
+        """Create a new :class:`CompiledQuery`."""
+        self.query = query.strip()
+        #: ``(word, characters, isascii, search, atom, mask, exact)``
+        #: for each word of the query. ``word`` is lowercase,
+        #: ``search`` is the :const:`MATCH_ALLCHARS` search function
+        #: for it and ``atom`` the word as it appears in an item's
+        #: atoms. ``mask`` is the word's character mask, and ``exact``
+        #: is ``True`` if every character has its own bit in it.
+        self.words = []
+        for word in self.query.split(' '):
+            word = word.strip().lower()
+            if word:
+                chars = frozenset(word)
+                self.words.append((word, chars, isascii(word),
+                                   _allchars_search(word),
+                                   '\0{0}\0'.format(word),
+                                   _char_mask(chars),
+                                   chars.issubset(_CHAR_BITS)))
+
+    def __repr__(self):
+        """Format query as a string."""
+        return 'CompiledQuery({0!r})'.format(self.query)
+
+
+def _char_mask(chars):
+    """Return bitmask of the characters in set ``chars``.
+
+    An item can only match a query word if its mask has all the bits
+    of the word's mask set.
+
+    """
+    mask = 0
+    for c in chars:
+        mask |= _CHAR_BITS.get(c, _OTHER_CHARS_BIT)
+    return mask
+
+
+def _fold_to_ascii(text):
+    """Convert non-ASCII characters to closest ASCII equivalent."""
+    if isascii(text):
+        return text
+    text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+    return unicode(unicodedata.normalize('NFKD',
+                   text).encode('ascii', 'ignore'))
+
+
+def _search_keys(value):
+    """Return search keys of ``value`` for :func:`_score_word`.
+
+    The keys are a list: ``[value, lowercase value, character mask,
+    capitals, atoms, initials]``. All but the first two are ``None``
+    until they are needed.
+
+    """
+    return [value, value.lower(), None, None, None, None]
+
+
+def _derive_capitals(keys):
+    """Fill in capitals of search ``keys``."""
+    keys[3] = ''.join([c for c in keys[0] if c in INITIALS]).lower()
+
+
+def _derive_atoms(keys):
+    """Fill in atoms and initials of search ``keys``."""
+    # split the item into "atoms", i.e. words separated by
+    # spaces or other non-word characters
+    atoms = [s.lower() for s in split_on_delimiters(keys[0])]
+    # joined into one string, which is faster to load from a cache.
+    # Atoms never contain NUL.
+    keys[4] = '\0{0}\0'.format('\0'.join(atoms))
+    # initials of the atoms
+    keys[5] = ''.join([s[0] for s in atoms if s])
+
+
+def _score_word(keys, word, match_on):
+    """Filter an item against one query ``word`` using rules ``match_on``.
+
+    ``keys`` are the item's search keys (see :func:`_search_keys`).
+    ``word`` is a tuple from :attr:`CompiledQuery.words`.
+
+    :returns: ``(score, rule)``
+
+    """
+    query, query_chars, _, search, atom, query_mask, exact = word
+    value, lower, mask = keys[:3]
+    if mask is None:
+        mask = keys[2] = _char_mask(set(lower))
+
+    # pre-filter any items that do not contain all characters
+    # of ``query`` to save on running several more expensive tests.
+    # The masks only tell characters without their own bit apart
+    # by checking the characters themselves.
+    if (query_mask & ~mask or
+            not exact and not query_chars <= set(lower)):
+
+        return (0, None)
+
+    # item starts with query
+    if match_on & MATCH_STARTSWITH and lower.startswith(query):
+        score = 100.0 - (len(value) / len(query))
+
+        return (score, MATCH_STARTSWITH)
+
+    # query matches capitalised letters in item,
+    # e.g. of = OmniFocus
+    if match_on & MATCH_CAPITALS:
+        if keys[3] is None:
+            _derive_capitals(keys)
+        capitals = keys[3]
+        if capitals.startswith(query):
+            score = 100.0 - (len(capitals) / len(query))
+
+            return (score, MATCH_CAPITALS)
+
+    if match_on & (MATCH_ATOM | MATCH_INITIALS):
+        if keys[4] is None:
+            _derive_atoms(keys)
+        atoms, initials = keys[4:]
+
+    if match_on & MATCH_ATOM:
+        # is `query` one of the atoms in item?
+        # similar to substring, but scores more highly, as it's
+        # a word within the item
+        if atom in atoms:
+            score = 100.0 - (len(value) / len(query))
+
+            return (score, MATCH_ATOM)
+
+    # `query` matches start (or all) of the initials of the
+    # atoms, e.g. ``himym`` matches "How I Met Your Mother"
+    # *and* "how i met your mother" (the ``capitals`` rule only
+    # matches the former)
+    if (match_on & MATCH_INITIALS_STARTSWITH and
+            initials.startswith(query)):
+        score = 100.0 - (len(initials) / len(query))
+
+        return (score, MATCH_INITIALS_STARTSWITH)
+
+    # `query` is a substring of initials, e.g. ``doh`` matches
+    # "The Dukes of Hazzard"
+    elif (match_on & MATCH_INITIALS_CONTAIN and
+            query in initials):
+        score = 95.0 - (len(initials) / len(query))
+
+        return (score, MATCH_INITIALS_CONTAIN)
+
+    # `query` is a substring of item
+    if match_on & MATCH_SUBSTRING and query in lower:
+        score = 90.0 - (len(value) / len(query))
+
+        return (score, MATCH_SUBSTRING)
+
+    # finally, assign a score based on how close together the
+    # characters in `query` are in item.
+    if match_on & MATCH_ALLCHARS:
+        match = search(value)
+        if match:
+            score = 100.0 / ((1 + match.start()) *
+                             (match.end() - match.start() + 1))
+
+            return (score, MATCH_ALLCHARS)
+
+    # Nothing matched
+    return (0, None)
+
+
+def _rank(results, ascending, include_score, max_results):
+    """Sort, prune and return filter ``results``.
+
+    ``results`` is an iterable of ``(sort key, (item, score, rule))``
+    tuples. If ``max_results`` is set, only the best ``max_results``
+    are kept (in a heap) instead of sorting all of them.
+
+    """
+    if max_results:
+        select = heapq.nlargest if ascending else heapq.nsmallest
+        results = select(max_results, results)
+    else:
+        results = sorted(results, reverse=ascending)
+
+    # discard the sort keys
+    results = [t[1] for t in results]
+
+    # return list of ``(item, score, rule)``
+    if include_score:
+        return results
+    # just return list of items
+    return [t[0] for t in results]
+
+
+class FilterIndex(object):
+    """Items with search keys for repeated filtering.
+
+    :meth:`filter` works like :meth:`Workflow.filter`, but the search
+    keys of each item (its lowercase and ASCII-folded versions,
+    capitals, atoms and initials) are derived only once, when they
+    are first needed. Use :meth:`cached` to also keep them between
+    runs of the workflow.
+
+    :param items: items to filter
+    :type items: ``list`` or ``tuple``
+    :param key: function to get comparison key from ``items``.
+        Must return a ``unicode`` string.
+    :type key: ``callable``
+
+    """
+
+    def __init__(self, items, key=lambda x: x):
+        """Create a new :class:`FilterIndex`."""
+        self.items = list(items)
+        self.key = key
+        # ``[value, keys, folded keys]`` of each item, created
+        # when first needed
+        self._entries = [None] * len(self.items)
+        # NumPy arrays of the items' character masks, as-is and
+        # folded (see `_screen`)
+        self._masks = {}
+
+    @classmethod
+    def cached(cls, wf, name, items, key=lambda x: x):
+        """Create index of ``items``, reusing keys cached by ``wf``.
+
+        The search keys are saved in the workflow's cache under
+        ``name`` with a hash of the items' comparison keys, so they
+        are only derived again when the comparison keys change.
+
+        :param wf: workflow whose cache to use
+        :type wf: :class:`Workflow`
+        :param name: name of cache
+        :type name: ``unicode``
+        :returns: :class:`FilterIndex`
+
+        """
+        index = cls(items, key)
+        digest = index.digest()
+        data = wf.cached_data(name, max_age=0)
+        if (data and data[0] == digest and
+                len(data[1]) == len(index.items)):
+            index._entries = data[1]
+        else:
+            index.derive()
+            wf.cache_data(name, (digest, index._entries))
+
+        return index
+
+    def digest(self):
+        """Hash of the items' comparison keys.
+
+        :returns: hex digest
+        :rtype: ``str``
+
+        """
+        h = hashlib.sha1()
+        for item in self.items:
+            h.update(self.key(item).encode('utf-8'))
+            h.update(b'\0')
+        return h.hexdigest()
+
+    def derive(self):
+        """Derive all search keys of all items now."""
+        for i in range(len(self.items)):
+            entry = self._entry(i)
+            for keys in (self._plain(entry), self._folded(entry)):
+                if keys[3] is None:
+                    keys[2] = _char_mask(set(keys[1]))
+                    _derive_capitals(keys)
+                    _derive_atoms(keys)
+
+    def filter(self, query, ascending=False, include_score=False,
+               min_score=0, max_results=0, match_on=MATCH_ALL,
+               fold_diacritics=True, processes=0):
+        """Return items that match ``query``.
+
+        See :meth:`Workflow.filter` for the arguments and scoring
+        rules. Unlike :meth:`Workflow.filter`, the user's diacritic
+        folding setting is not applied.
+
+        """
+        if not isinstance(query, CompiledQuery):
+            if not query:
+                return self.items
+
+            query = CompiledQuery(query)
+
+        if not query.words:
+            return self.items
+
+        indices = self._screen(query.words, fold_diacritics)
+        if indices is None:
+            indices = range(len(self.items))
+
+        if processes > 1 and len(indices) >= _PARALLEL_MIN_ITEMS:
+            matches = self._matches_parallel(
+                query, indices, match_on, fold_diacritics, min_score,
+                ascending, max_results, processes)
+        else:
+            matches = self._matches(query.words, indices, match_on,
+                                    fold_diacritics, min_score)
+
+        items = self.items
+        results = ((k, (items[i], score, rule))
+                   for k, i, score, rule in matches)
+        return _rank(results, ascending, include_score, max_results)
+
+    def _matches_parallel(self, query, indices, match_on, fold_diacritics,
+                          min_score, ascending, max_results, processes):
+        """Find matches for ``query`` with ``processes`` worker processes.
+
+        Each worker filters a shard of ``indices`` (see
+        :func:`_filter_shard`). Returns the workers' matches in the
+        order of ``indices``.
+
+        """
+        import multiprocessing
+
+        global _pool_index
+        size = -(-len(indices) // processes)
+        tasks = [(query.query, indices[i:i + size], match_on, fold_diacritics,
+                  min_score, ascending, max_results)
+                 for i in range(0, len(indices), size)]
+
+        _pool_index = self
+        pool = multiprocessing.Pool(processes)
+        try:
+            shards = pool.map(_filter_shard, tasks)
+        finally:
+            pool.terminate()
+            pool.join()
+            _pool_index = None
+
+        return list(itertools.chain.from_iterable(shards))
+
+    def _matches(self, words, indices, match_on, fold_diacritics, min_score):
+        """Generate matches of the items at ``indices`` for ``words``.
+
+        Matches are ``(sort key, index, score, rule)`` tuples.
+
+        """
+        items = self.items
+        entries = self._entries
+        key = self.key
+
+        for i in indices:
+            item = items[i]
+            entry = entries[i]
+            if entry is None:
+                entry = entries[i] = [key(item).strip(), None, None]
+            if entry[0] == '':
+                continue
+            score = 0
+            for word in words:
+                if fold_diacritics and word[2]:
+                    keys = entry[2] or self._folded(entry)
+                else:
+                    keys = entry[1] or self._plain(entry)
+
+                s, rule = _score_word(keys, word, match_on)
+
+                if not s:  # Skip items that don't match part of the query
+                    break
+                score += s
+
+            else:
+                if score and (not min_score or score > min_score):
+                    # use "reversed" `score` (i.e. highest becomes lowest)
+                    # and `value` as sort key. This means items with the
+                    # same score will be sorted in alphabetical not reverse
+                    # alphabetical order
+                    yield ((100.0 / score, entry[0].lower(), score),
+                           i, score, rule)
+
+    def _screen(self, words, fold_diacritics):
+        """Return indices of items whose masks match all ``words``.
+
+        Uses NumPy to test all items at once. Returns ``None`` if
+        there are too few items or NumPy isn't installed.
+
+        """
+        if len(self.items) < _NUMPY_MIN_ITEMS:
+            return None
+
+        try:
+            import numpy
+        except ImportError:
+            return None
+
+        keep = None
+        for word in words:
+            folded = bool(fold_diacritics and word[2])
+            masks = self._masks.get(folded)
+            if masks is None:
+                masks = self._masks[folded] = numpy.array(
+                    self._item_masks(folded), dtype=numpy.uint64)
+
+            mask = numpy.uint64(word[5])
+            match = (masks & mask) == mask
+            keep = match if keep is None else keep & match
+
+        return numpy.flatnonzero(keep).tolist()
+
+    def _item_masks(self, folded):
+        """Return character masks of all items (as-is or folded)."""
+        masks = []
+        for i in range(len(self.items)):
+            entry = self._entry(i)
+            keys = self._folded(entry) if folded else self._plain(entry)
+            if keys[2] is None:
+                keys[2] = _char_mask(set(keys[1]))
+            masks.append(keys[2])
+
+        return masks
+
+    def _entry(self, i):
+        """Return entry of item ``i``."""
+        entry = self._entries[i]
+        if entry is None:
+            entry = [self.key(self.items[i]).strip(), None, None]
+            self._entries[i] = entry
+
+        return entry
+
+    def _plain(self, entry):
+        """Return search keys of ``entry``."""
+        if entry[1] is None:
+            entry[1] = _search_keys(entry[0])
+
+        return entry[1]
+
+    def _folded(self, entry):
+        """Return ASCII-folded search keys of ``entry``."""
+        if entry[2] is None:
+            value = entry[0]
+            folded = _fold_to_ascii(value)
+            if folded is value:  # nothing to fold
+                entry[2] = self._plain(entry)
+            else:
+                entry[2] = _search_keys(folded)
+
+        return entry[2]
+
+
+def _filter_shard(args):
+    """Return matches in one shard of :data:`_pool_index`'s items.
+
+    Called in a worker process by :meth:`FilterIndex._matches_parallel`.
+    If ``max_results`` is set, only matches that may be among the best
+    are returned: those with a sort key no worse than the
+    ``max_results``-th best. Ties are kept, as the items themselves
+    decide their order.
+
+    """
+    (query, indices, match_on, fold_diacritics, min_score, ascending,
+     max_results) = args
+    words = CompiledQuery(query).words
+    matches = list(_pool_index._matches(words, indices, match_on,
+                                        fold_diacritics, min_score))
+
+    if max_results and len(matches) > max_results:
+        if ascending:
+            last = heapq.nlargest(max_results, [m[0] for m in matches])[-1]
+            matches = [m for m in matches if m[0] >= last]
+        else:
+            last = heapq.nsmallest(max_results, [m[0] for m in matches])[-1]
+            matches = [m for m in matches if m[0] <= last]
+
+    return matches
+
+
 ####################################################################
 # Used by `Workflow.check_update`
 ####################################################################
@@ -964,8 +1482,6 @@ class Workflow(object):
         self._version = UNSET
         # Version from last workflow run
         self._last_version_run = UNSET
-        # Cache for regex patterns created for filter keys
-        self._search_pattern_cache = {}
         #: Prefix for all magic arguments.
         #: The default value is ``workflow:`` so keyword
         #: ``config`` would match user query ``workflow:config``.
@@ -1764,7 +2280,7 @@ class Workflow(object):
 
     def filter(self, query, items, key=lambda x: x, ascending=False,
                include_score=False, min_score=0, max_results=0,
-               match_on=MATCH_ALL, fold_diacritics=True):
+               match_on=MATCH_ALL, fold_diacritics=True, processes=0):
         """Fuzzy search filter. Returns list of ``items`` that match ``query``.
 
         ``query`` is case-insensitive. Any item that does not contain the
@@ -1774,7 +2290,7 @@ class Workflow(object):
         all items will match.
 
         :param query: query to test items against
-        :type query: ``unicode``
+        :type query: ``unicode`` or :class:`CompiledQuery`
         :param items: iterable of items to test
         :type items: ``list`` or ``tuple``
         :param key: function to get comparison key from ``items``.
@@ -1798,6 +2314,10 @@ class Workflow(object):
         :param fold_diacritics: Convert search keys to ASCII-only
             characters if ``query`` only contains ASCII characters.
         :type fold_diacritics: ``Boolean``
+        :param processes: If greater than 1, filter large lists of
+            ``items`` in this many worker processes. The results are
+            the same.
+        :type processes: ``int``
         :returns: list of ``items`` matching ``query`` or list of
             ``(item, score, rule)`` `tuples` if ``include_score`` is ``True``.
             ``rule`` is the ``MATCH_*`` rule that matched the item.
@@ -1863,170 +2383,22 @@ class Workflow(object):
         altered.
 
         """
-        if not query:
-            return items
+        if not isinstance(query, CompiledQuery):
+            if not query:
+                return items
 
-        # Remove preceding/trailing spaces
-        query = query.strip()
+            query = CompiledQuery(query)
 
-        if not query:
+        if not query.words:
             return items
 
         # Use user override if there is one
         fold_diacritics = self.settings.get('__workflow_diacritic_folding',
                                             fold_diacritics)
 
-        results = []
-
-        for item in items:
-            skip = False
-            score = 0
-            words = [s.strip() for s in query.split(' ')]
-            value = key(item).strip()
-            if value == '':
-                continue
-            for word in words:
-                if word == '':
-                    continue
-                s, rule = self._filter_item(value, word, match_on,
-                                            fold_diacritics)
-
-                if not s:  # Skip items that don't match part of the query
-                    skip = True
-                score += s
-
-            if skip:
-                continue
-
-            if score:
-                # use "reversed" `score` (i.e. highest becomes lowest) and
-                # `value` as sort key. This means items with the same score
-                # will be sorted in alphabetical not reverse alphabetical order
-                results.append(((100.0 / score, value.lower(), score),
-                                (item, score, rule)))
-
-        # sort on keys, then discard the keys
-        results.sort(reverse=ascending)
-        results = [t[1] for t in results]
-
-        if min_score:
-            results = [r for r in results if r[1] > min_score]
-
-        if max_results and len(results) > max_results:
-            results = results[:max_results]
-
-        # return list of ``(item, score, rule)``
-        if include_score:
-            return results
-        # just return list of items
-        return [t[0] for t in results]
-
-    def _filter_item(self, value, query, match_on, fold_diacritics):
-        """Filter ``value`` against ``query`` using rules ``match_on``.
-
-        :returns: ``(score, rule)``
-
-        """
-        query = query.lower()
-
-        if not isascii(query):
-            fold_diacritics = False
-
-        if fold_diacritics:
-            value = self.fold_to_ascii(value)
-
-        # pre-filter any items that do not contain all characters
-        # of ``query`` to save on running several more expensive tests
-        if not set(query) <= set(value.lower()):
-
-            return (0, None)
-
-        # item starts with query
-        if match_on & MATCH_STARTSWITH and value.lower().startswith(query):
-            score = 100.0 - (len(value) / len(query))
-
-            return (score, MATCH_STARTSWITH)
-
-        # query matches capitalised letters in item,
-        # e.g. of = OmniFocus
-        if match_on & MATCH_CAPITALS:
-            initials = ''.join([c for c in value if c in INITIALS])
-            if initials.lower().startswith(query):
-                score = 100.0 - (len(initials) / len(query))
-
-                return (score, MATCH_CAPITALS)
-
-        # split the item into "atoms", i.e. words separated by
-        # spaces or other non-word characters
-        if (match_on & MATCH_ATOM or
-                match_on & MATCH_INITIALS_CONTAIN or
-                match_on & MATCH_INITIALS_STARTSWITH):
-            atoms = [s.lower() for s in split_on_delimiters(value)]
-            # print('atoms : %s  -->  %s' % (value, atoms))
-            # initials of the atoms
-            initials = ''.join([s[0] for s in atoms if s])
-
-        if match_on & MATCH_ATOM:
-            # is `query` one of the atoms in item?
-            # similar to substring, but scores more highly, as it's
-            # a word within the item
-            if query in atoms:
-                score = 100.0 - (len(value) / len(query))
-
-                return (score, MATCH_ATOM)
-
-        # `query` matches start (or all) of the initials of the
-        # atoms, e.g. ``himym`` matches "How I Met Your Mother"
-        # *and* "how i met your mother" (the ``capitals`` rule only
-        # matches the former)
-        if (match_on & MATCH_INITIALS_STARTSWITH and
-                initials.startswith(query)):
-            score = 100.0 - (len(initials) / len(query))
-
-            return (score, MATCH_INITIALS_STARTSWITH)
-
-        # `query` is a substring of initials, e.g. ``doh`` matches
-        # "The Dukes of Hazzard"
-        elif (match_on & MATCH_INITIALS_CONTAIN and
-                query in initials):
-            score = 95.0 - (len(initials) / len(query))
-
-            return (score, MATCH_INITIALS_CONTAIN)
-
-        # `query` is a substring of item
-        if match_on & MATCH_SUBSTRING and query in value.lower():
-            score = 90.0 - (len(value) / len(query))
-
-            return (score, MATCH_SUBSTRING)
-
-        # finally, assign a score based on how close together the
-        # characters in `query` are in item.
-        if match_on & MATCH_ALLCHARS:
-            search = self._search_for_query(query)
-            match = search(value)
-            if match:
-                score = 100.0 / ((1 + match.start()) *
-                                 (match.end() - match.start() + 1))
-
-                return (score, MATCH_ALLCHARS)
-
-        # Nothing matched
-        return (0, None)
-
-    def _search_for_query(self, query):
-        if query in self._search_pattern_cache:
-            return self._search_pattern_cache[query]
-
-        # Build pattern: include all characters
-        pattern = []
-        for c in query:
-            # pattern.append('[^{0}]*{0}'.format(re.escape(c)))
-            pattern.append('.*?{0}'.format(re.escape(c)))
-        pattern = ''.join(pattern)
-        search = re.compile(pattern, re.IGNORECASE).search
-
-        self._search_pattern_cache[query] = search
-        return search
+        return FilterIndex(items, key).filter(
+            query, ascending, include_score, min_score, max_results,
+            match_on, fold_diacritics, processes)
 
     def run(self, func, text_errors=False):
         """Call ``func`` to run your workflow.
@@ -2715,11 +3087,7 @@ class Workflow(object):
         :rtype: ``unicode``
 
         """
-        if isascii(text):
-            return text
-        text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
-        return unicode(unicodedata.normalize('NFKD',
-                       text).encode('ascii', 'ignore'))
+        return _fold_to_ascii(text)
 
     def dumbify_punctuation(self, text):
         """Convert non-ASCII punctuation to closest ASCII equivalent.
@@ -0,0 +1,142 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Fixtures for testing the workflow's libraries.
+
+`FakeMPD` is a tiny MPD server whose responses are set by the tests.
+"""
+
+from __future__ import print_function, absolute_import
+
+import os
+import socket
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'src'))
+
+from lib import mpd  # noqa: E402
+
+
+class Hangup(bytes):
+    """Response after which `FakeMPD` closes the connection."""
+
+
+class FakeMPD(object):
+    """MPD server that answers requests via ``handler``.
+
+    ``handler`` is called with each request (a command line or a whole
+    command list, as bytes) and returns the response. If it returns
+    `None`, the connection is closed without a response, and if it
+    returns a `Hangup`, after the response. All requests are saved
+    in ``requests``.
+    """
+
+    def __init__(self, version='0.23.0'):
+        """Start server on a free port."""
+        self.version = version
+        self.handler = lambda request: b'OK\n'
+        self.requests = []
+        self.connections = []
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(('127.0.0.1', 0))
+        self._sock.listen(16)
+        self.port = self._sock.getsockname()[1]
+        t = threading.Thread(target=self._serve)
+        t.daemon = True
+        t.start()
+
+    def count(self, command):
+        """Return number of requests starting with ``command``."""
+        prefix = command.encode('utf-8')
+        return len([r for r in self.requests if r.startswith(prefix)])
+
+    def drop_connections(self):
+        """Close all client connections (like a restarted MPD)."""
+        for conn in self.connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            conn.close()
+
+        self.connections = []
+
+    def close(self):
+        """Stop server."""
+        self.drop_connections()
+        self._sock.close()
+
+    def _serve(self):
+        """Accept connections until closed."""
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except socket.error:
+                return
+
+            self.connections.append(conn)
+            t = threading.Thread(target=self._handle, args=(conn,))
+            t.daemon = True
+            t.start()
+
+    def _handle(self, conn):
+        """Answer requests on ``conn``."""
+        rfile = conn.makefile('rb')
+        try:
+            conn.sendall('OK MPD {}\n'.format(self.version).encode())
+            while True:
+                request = rfile.readline()
+                if request.startswith(b'command_list_'):
+                    line = request
+                    while line and not line.startswith(b'command_list_end'):
+                        line = rfile.readline()
+                        request += line
+
+                if not request:
+                    return
+
+                self.requests.append(request)
+                response = self.handler(request)
+                if response is None:
+                    return
+
+                conn.sendall(response)
+                if isinstance(response, Hangup):
+                    return
+        except (socket.error, ValueError):
+            pass
+        finally:
+            rfile.close()
+            conn.close()
+
+
+@pytest.fixture
+def fake_mpd(monkeypatch):
+    """`FakeMPD` that the `mpd` module connects to."""
+    server = FakeMPD()
+    monkeypatch.setattr(mpd, 'MPD_HOST', '127.0.0.1')
+    monkeypatch.setattr(mpd, 'MPD_PORT', str(server.port))
+    monkeypatch.setattr(mpd, 'MPD_PASSWORD', '')
+    monkeypatch.setattr(mpd, 'MPD_TIMEOUT', 1.0)
+    monkeypatch.setattr(mpd, 'BACKEND', 'native')
+    monkeypatch.setattr(mpd, 'BROKER_SOCKET', None)
+    monkeypatch.setattr(mpd, 'INDEX_PATH', None)
+    monkeypatch.setattr(mpd, 'STATUS_BOARD', None)
+    mpd._local.client = None
+    yield server
+    c = getattr(mpd._local, 'client', None)
+    if c is not None:
+        c.close()
+        mpd._local.client = None
+    server.close()
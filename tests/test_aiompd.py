@@ -0,0 +1,100 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for `aiompd.AsyncClient`."""
+
+import asyncio
+import sys
+
+import pytest
+
+if sys.version_info < (3, 7):
+    pytest.skip('tests need asyncio.run (Python 3.7+)',
+                allow_module_level=True)
+
+from lib import aiompd, mpd  # noqa: E402
+
+
+def run(fake_mpd, func):
+    """Call coroutine function ``func`` with a client of ``fake_mpd``.
+
+    Fails if it takes longer than a few seconds, e.g. because a
+    command never gets its response.
+    """
+    async def main():
+        c = aiompd.AsyncClient('127.0.0.1', fake_mpd.port, password='',
+                               timeout=1.0)
+        try:
+            return await asyncio.wait_for(func(c), 3)
+        finally:
+            c.close()
+
+    return asyncio.run(main())
+
+
+def test_pipelining(fake_mpd):
+    """Responses to concurrent commands go to the right caller."""
+    fake_mpd.handler = lambda r: b'cmd: ' + r.split()[0] + b'\nOK\n'
+
+    async def main(c):
+        return await asyncio.gather(c.command('status'), c.command('stats'),
+                                    c.command('ping'))
+
+    assert run(fake_mpd, main) == [[(u'cmd', u'status')],
+                                   [(u'cmd', u'stats')],
+                                   [(u'cmd', u'ping')]]
+    assert fake_mpd.requests == [b'status\n', b'stats\n', b'ping\n']
+    assert len(fake_mpd.connections) == 1
+
+
+def test_ack(fake_mpd):
+    """An ACK only fails its own command."""
+    fake_mpd.handler = lambda r: (b'ACK [5@0] {bogus} unknown command\n'
+                                  if r == b'bogus\n' else b'OK\n')
+
+    async def main(c):
+        return await asyncio.gather(c.command('ping'), c.command('bogus'),
+                                    c.command('ping'),
+                                    return_exceptions=True)
+
+    first, err, last = run(fake_mpd, main)
+    assert first == last == []
+    assert isinstance(err, mpd.CommandFailed)
+    assert (err.cmd, err.reason) == (u'bogus', u'unknown command')
+
+
+def test_disconnect_fails_pending(fake_mpd):
+    """Commands waiting for responses fail if MPD closes the connection."""
+    fake_mpd.handler = lambda r: b'OK\n' if r == b'ping\n' else None
+
+    async def main(c):
+        return await asyncio.gather(c.command('ping'), c.command('update'),
+                                    c.command('status'),
+                                    return_exceptions=True)
+
+    results = run(fake_mpd, main)
+    assert results[0] == []
+    assert [type(e) for e in results[1:]] == [mpd.ConnectionError] * 2
+
+
+@pytest.mark.parametrize('response', [
+    b'Title: \xff\xfe\nOK\n',   # not UTF-8
+    b'binary: lots\nOK\n',      # bad size
+])
+def test_bad_response_fails_pending(fake_mpd, response):
+    """Commands fail instead of hanging if a response can't be read."""
+    fake_mpd.handler = lambda r: response if r == b'currentsong\n' else None
+
+    async def main(c):
+        return await asyncio.gather(c.command('currentsong'),
+                                    c.command('status'),
+                                    return_exceptions=True)
+
+    errs = run(fake_mpd, main)
+    assert [type(e) for e in errs] == [mpd.ConnectionError] * 2
@@ -0,0 +1,298 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for `Workflow.filter` and `FilterIndex`.
+
+Results are compared with `reference_filter`, the scoring of the
+original `Workflow.filter` (before compiled queries, search-key
+caching, top-K selection, bitmask screening and worker processes).
+"""
+
+from __future__ import print_function, unicode_literals
+
+import random
+import re
+import sys
+import unicodedata
+
+import pytest
+
+# Alfred-Workflow only runs on Python 2
+wfmod = pytest.importorskip('lib.workflow.workflow')
+
+from lib.workflow import FilterIndex, Workflow  # noqa: E402
+from lib.workflow.workflow import (  # noqa: E402
+    ASCII_REPLACEMENTS, CompiledQuery, INITIALS, MATCH_ALL, MATCH_ALLCHARS,
+    MATCH_ATOM, MATCH_CAPITALS, MATCH_INITIALS, MATCH_INITIALS_CONTAIN,
+    MATCH_INITIALS_STARTSWITH, MATCH_STARTSWITH, MATCH_SUBSTRING,
+    isascii, split_on_delimiters,
+)
+
+RULES = (MATCH_STARTSWITH, MATCH_CAPITALS, MATCH_ATOM,
+         MATCH_INITIALS_STARTSWITH, MATCH_INITIALS_CONTAIN, MATCH_INITIALS,
+         MATCH_SUBSTRING, MATCH_ALLCHARS, MATCH_ALL,
+         MATCH_ALL ^ MATCH_ALLCHARS)
+
+ITEMS = [
+    'OmniFocus', 'omnifocus', 'Office', 'How I Met Your Mother',
+    'how i met your mother', 'The Dukes of Hazzard', 'Radiohead - Kid A',
+    'Kid A', 'Kid Koala', 'Über Café', 'Uber Cafe', 'Straße', 'strasse',
+    'Émilie Simon', 'Sigur Rós', 'AC/DC', 'Guns N\' Roses', 'foo_bar.mp3',
+    'foo-bar [live]', '  padded  ', '', ' ', '1999', 'Prince - 1999',
+    'naïve', 'Ærøskøbing', 'tilde~and{braces}`|', 'BjöRk', 'Mötley Crüe',
+    'ab', 'ba', 'abc abc', 'x',
+]
+
+QUERIES = [
+    'of', 'omni', 'himym', 'doh', 'kid', 'kid a', 'ka', 'ube', 'über',
+    'cafe', 'café', 'ss', 'ß', 'rdh', 'a', 'ac', 'ac/dc', 'n', '19',
+    'sim', 'rós', 'ros', 'nai', 'naï', 'ae', 'mc', 'crue', '~', '{b', '`|',
+    'foo_', 'mp3', 'live', 'xyz', 'ab', '  kid  ', 'zz',
+]
+
+
+def _reference_fold(text):
+    """Original `Workflow.fold_to_ascii`."""
+    if isascii(text):
+        return text
+    text = ''.join([ASCII_REPLACEMENTS.get(c, c) for c in text])
+    return unicode(unicodedata.normalize('NFKD',
+                   text).encode('ascii', 'ignore'))
+
+
+def _reference_item(value, query, match_on, fold_diacritics):
+    """Original `Workflow._filter_item`."""
+    query = query.lower()
+
+    if not isascii(query):
+        fold_diacritics = False
+
+    if fold_diacritics:
+        value = _reference_fold(value)
+
+    if not set(query) <= set(value.lower()):
+        return (0, None)
+
+    if match_on & MATCH_STARTSWITH and value.lower().startswith(query):
+        return (100.0 - (len(value) / len(query)), MATCH_STARTSWITH)
+
+    if match_on & MATCH_CAPITALS:
+        initials = ''.join([c for c in value if c in INITIALS])
+        if initials.lower().startswith(query):
+            return (100.0 - (len(initials) / len(query)), MATCH_CAPITALS)
+
+    if (match_on & MATCH_ATOM or
+            match_on & MATCH_INITIALS_CONTAIN or
+            match_on & MATCH_INITIALS_STARTSWITH):
+        atoms = [s.lower() for s in split_on_delimiters(value)]
+        initials = ''.join([s[0] for s in atoms if s])
+
+    if match_on & MATCH_ATOM:
+        if query in atoms:
+            return (100.0 - (len(value) / len(query)), MATCH_ATOM)
+
+    if (match_on & MATCH_INITIALS_STARTSWITH and
+            initials.startswith(query)):
+        return (100.0 - (len(initials) / len(query)),
+                MATCH_INITIALS_STARTSWITH)
+
+    elif (match_on & MATCH_INITIALS_CONTAIN and
+            query in initials):
+        return (95.0 - (len(initials) / len(query)), MATCH_INITIALS_CONTAIN)
+
+    if match_on & MATCH_SUBSTRING and query in value.lower():
+        return (90.0 - (len(value) / len(query)), MATCH_SUBSTRING)
+
+    if match_on & MATCH_ALLCHARS:
+        pattern = ''.join('.*?{0}'.format(re.escape(c)) for c in query)
+        match = re.compile(pattern, re.IGNORECASE).search(value)
+        if match:
+            return (100.0 / ((1 + match.start()) *
+                             (match.end() - match.start() + 1)),
+                    MATCH_ALLCHARS)
+
+    return (0, None)
+
+
+def reference_filter(query, items, key=lambda x: x, ascending=False,
+                     include_score=False, min_score=0, max_results=0,
+                     match_on=MATCH_ALL, fold_diacritics=True):
+    """Original `Workflow.filter`."""
+    if not query:
+        return items
+
+    query = query.strip()
+    if not query:
+        return items
+
+    results = []
+    for item in items:
+        skip = False
+        score = 0
+        words = [s.strip() for s in query.split(' ')]
+        value = key(item).strip()
+        if value == '':
+            continue
+        for word in words:
+            if word == '':
+                continue
+            s, rule = _reference_item(value, word, match_on, fold_diacritics)
+            if not s:
+                skip = True
+            score += s
+
+        if skip:
+            continue
+
+        if score:
+            results.append(((100.0 / score, value.lower(), score),
+                            (item, score, rule)))
+
+    results.sort(reverse=ascending)
+    results = [t[1] for t in results]
+
+    if min_score:
+        results = [r for r in results if r[1] > min_score]
+
+    if max_results and len(results) > max_results:
+        results = results[:max_results]
+
+    if include_score:
+        return results
+    return [t[0] for t in results]
+
+
+def random_items(n, seed=1):
+    """Return ``n`` random item names built from `ITEMS`' words."""
+    rnd = random.Random(seed)
+    words = ' '.join(ITEMS).split()
+    return [' '.join(rnd.choice(words) for _ in range(rnd.randint(1, 4)))
+            for _ in range(n)]
+
+
+@pytest.fixture
+def wf(tmpdir, monkeypatch):
+    """`Workflow` with its data & cache directories in ``tmpdir``."""
+    # environment variables must be native strings
+    for name, value in (('bundleid', 'net.deanishe.test'),
+                        ('data', tmpdir.mkdir('data')),
+                        ('cache', tmpdir.mkdir('cache'))):
+        monkeypatch.setenv(str('alfred_workflow_' + name), str(value))
+    return Workflow()
+
+
+@pytest.mark.parametrize('match_on', RULES)
+def test_match_rules(match_on):
+    """Each rule scores and ranks items like the original filter."""
+    index = FilterIndex(ITEMS)
+    for query in QUERIES:
+        expected = reference_filter(query, ITEMS, include_score=True,
+                                    match_on=match_on)
+        assert index.filter(query, include_score=True,
+                            match_on=match_on) == expected, query
+
+
+@pytest.mark.parametrize('fold', [True, False])
+def test_fold_diacritics(fold):
+    """Diacritics are folded only for ASCII queries, if asked to."""
+    index = FilterIndex(ITEMS)
+    for query in QUERIES:
+        assert index.filter(query, include_score=True,
+                            fold_diacritics=fold) == reference_filter(
+            query, ITEMS, include_score=True, fold_diacritics=fold), query
+
+
+@pytest.mark.parametrize('min_score,max_results,ascending', [
+    (0, 0, True), (30, 0, False), (90, 0, False), (0, 1, False),
+    (0, 3, True), (50, 2, False), (0, 1000, False),
+])
+def test_min_score_max_results(min_score, max_results, ascending):
+    """Pruning and order match the original filter."""
+    items = ITEMS + random_items(300)
+    index = FilterIndex(items)
+    for query in QUERIES:
+        opts = dict(include_score=True, min_score=min_score,
+                    max_results=max_results, ascending=ascending)
+        assert index.filter(query, **opts) == reference_filter(
+            query, items, **opts), query
+
+
+def test_workflow_filter(wf):
+    """`Workflow.filter` gives the original results."""
+    items = [(i, name) for i, name in enumerate(ITEMS)]
+    key = lambda t: t[1]  # noqa: E731
+    for query in QUERIES + ['', '   ']:
+        assert wf.filter(query, items, key, min_score=20) == \
+            reference_filter(query, items, key, min_score=20), query
+
+    compiled = CompiledQuery('kid a')
+    assert wf.filter(compiled, items, key) == \
+        reference_filter('kid a', items, key)
+
+
+def test_workflow_filter_fold_setting(wf):
+    """The user's diacritic folding setting overrides the argument."""
+    wf.settings['__workflow_diacritic_folding'] = False
+    assert wf.filter('cafe', ITEMS) == reference_filter(
+        'cafe', ITEMS, fold_diacritics=False)
+
+
+def test_cached_index(wf):
+    """Search keys restored from the cache give the same results."""
+    items = ITEMS + random_items(100)
+    first = FilterIndex.cached(wf, 'test', items).filter('kid')
+    index = FilterIndex.cached(wf, 'test', items)
+    assert index._entries[0] is not None  # loaded from cache
+    assert index.filter('kid') == first == reference_filter('kid', items)
+
+
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs fork')
+def test_parallel(monkeypatch):
+    """Worker processes give the same results as one process."""
+    monkeypatch.setattr(wfmod, '_PARALLEL_MIN_ITEMS', 10)
+    items = ITEMS + random_items(500)
+    index = FilterIndex(items)
+    for query in ('kid', 'ube', 'ka', 'xyz'):
+        for max_results in (0, 5):
+            opts = dict(include_score=True, min_score=10,
+                        max_results=max_results)
+            assert index.filter(query, processes=3, **opts) == \
+                reference_filter(query, items, **opts), query
+
+
+def test_screen_numpy(monkeypatch):
+    """Items screened with NumPy give the same results as without."""
+    pytest.importorskip('numpy')
+    monkeypatch.setattr(wfmod, '_NUMPY_MIN_ITEMS', 10)
+    items = ITEMS + random_items(1000)
+    queries = QUERIES + ['_', '{', '|', 'é', 'ø ', 'Ærø', 'a~a']
+    words = CompiledQuery('kid').words
+
+    index = FilterIndex(items)
+    assert index._screen(words, True) is not None
+    with_numpy = [index.filter(q, include_score=True, fold_diacritics=f)
+                  for q in queries for f in (True, False)]
+
+    monkeypatch.setitem(sys.modules, 'numpy', None)  # ImportError
+    index = FilterIndex(items)
+    assert index._screen(words, True) is None
+    without = [index.filter(q, include_score=True, fold_diacritics=f)
+               for q in queries for f in (True, False)]
+
+    assert with_numpy == without
+    assert without == [reference_filter(q, items, include_score=True,
+                                        fold_diacritics=f)
+                       for q in queries for f in (True, False)]
+
+
+def test_screen_mask_bits():
+    """63 characters have their own bit, the others share bit 64."""
+    bits = list(wfmod._CHAR_BITS.values()) + [wfmod._OTHER_CHARS_BIT]
+    assert len(set(bits)) == 64
+    assert max(bits) == 1 << 63
@@ -0,0 +1,184 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for `index.LibraryIndex`."""
+
+from __future__ import print_function, absolute_import
+
+import os
+
+import pytest
+
+from lib import index, mpd
+
+pytestmark = pytest.mark.skipif(not index.AVAILABLE,
+                                reason='SQLite has no trigram tokenizer')
+
+
+def song(path, lm=u'2017-01-01', **tags):
+    """Return song dict like `mpd.lsinfo` does."""
+    d = {u'file': path, u'last-modified': lm}
+    d.update(tags)
+    return d
+
+
+def directory(path, lm=u'2017-01-01'):
+    """Return directory dict like `mpd.lsinfo` does."""
+    return {u'directory': path, u'last-modified': lm}
+
+
+class Library(object):
+    """Directory tree served by a fake `mpd.lsinfo`."""
+
+    def __init__(self, monkeypatch):
+        """Patch `mpd` to list this library."""
+        self.tree = {}
+        self.modified = []
+        self.listed = []
+        monkeypatch.setattr(mpd, 'lsinfo', self.lsinfo)
+        monkeypatch.setattr(mpd, 'modified_since', lambda ts: self.modified)
+
+    def lsinfo(self, paths):
+        """List directories ``paths``."""
+        self.listed.extend(paths)
+        return [list(self.tree[p]) for p in paths]
+
+
+@pytest.fixture
+def library(monkeypatch):
+    """Library with two albums by two artists."""
+    lib = Library(monkeypatch)
+    lib.tree = {
+        u'': [directory(u'Music')],
+        u'Music': [directory(u'Music/Kid A'), directory(u'Music/Blue')],
+        u'Music/Kid A': [
+            song(u'Music/Kid A/01.mp3', artist=u'Radiohead',
+                 album=u'Kid A', track=u'1', title=u'Everything'),
+            song(u'Music/Kid A/02.mp3', artist=u'Radiohead',
+                 album=u'Kid A', track=u'2', title=u'Kid A'),
+        ],
+        u'Music/Blue': [
+            song(u'Music/Blue/01.flac', artist=u'Joni Mitchell',
+                 album=u'Blue', track=u'1', title=u'All I Want'),
+        ],
+    }
+    return lib
+
+
+@pytest.fixture
+def idx(tmpdir, library):
+    """`LibraryIndex` built from ``library``."""
+    i = index.LibraryIndex(str(tmpdir.join('library.db')))
+    i.build(mpd.library(), 100)
+    return i
+
+
+def titles(rows):
+    """Return titles of search results."""
+    return [r['title'] for r in rows]
+
+
+def test_build(idx):
+    """Index contains songs and knows the database version."""
+    assert idx.db_update == 100
+    assert len(idx.search([u'any', u'kid'], limit=0)) == 2
+    assert os.listdir(os.path.dirname(idx.path)) == ['library.db']
+
+
+def test_build_failed(tmpdir):
+    """A failed build leaves nothing behind."""
+    def songs():
+        yield song(u'a.mp3')
+        raise mpd.ConnectionError('Connection to MPD lost')
+
+    i = index.LibraryIndex(str(tmpdir.join('library.db')))
+    with pytest.raises(mpd.ConnectionError):
+        i.build(songs(), 100)
+
+    assert tmpdir.listdir() == []
+    assert not i.exists
+
+
+def test_search_substring(idx):
+    """Search matches case-insensitive substrings, like MPD's ``search``."""
+    assert sorted(titles(idx.search([u'any', u'OHEAD']))) == [
+        u'Everything', u'Kid A']
+    assert titles(idx.search([u'artist', u'mitch'])) == [u'All I Want']
+    assert titles(idx.search([u'any', u'head', u'title', u'ything'])) == [
+        u'Everything']
+    assert idx.search([u'artist', u'radiohead blue']) == []
+
+
+def test_search_any_ignores_path(idx):
+    """``any`` doesn't match the path, but ``file`` does."""
+    assert idx.search([u'any', u'flac']) == []
+    assert idx.search([u'any', u'music']) == []
+    assert titles(idx.search([u'file', u'flac'])) == [u'All I Want']
+
+
+def test_search_unanswerable(idx):
+    """Queries the index can't answer return `None`."""
+    assert idx.search([u'any', u'ki']) is None  # too short
+    assert idx.search([u'comment', u'live']) is None  # not indexed
+    assert idx.search([u'any', u'x'], sort=u'comment') is None
+
+
+def test_search_exact(idx):
+    """Exact search matches whole values."""
+    assert titles(idx.search([u'album', u'Kid A'], exact=True)) == [
+        u'Everything', u'Kid A']
+    assert titles(idx.search([u'any', u'Kid A'], exact=True)) == [
+        u'Everything', u'Kid A']
+    assert idx.search([u'album', u'Kid'], exact=True) == []
+    assert idx.search([u'any', u'Music/Blue/01.flac'], exact=True) == []
+
+
+def test_search_sort_and_page(idx):
+    """Results can be sorted and paged."""
+    rows = idx.search([u'artist', u'adio'], sort=u'-title')
+    assert titles(rows) == [u'Kid A', u'Everything']
+    rows = idx.search([u'artist', u'adio'], sort=u'title', limit=1, offset=1)
+    assert titles(rows) == [u'Kid A']
+
+
+def test_sync(idx, library):
+    """Sync applies added, changed and deleted songs and directories."""
+    library.tree[u'Music'] = [directory(u'Music/Kid A', u'2017-02-01'),
+                              directory(u'Music/Amnesiac')]
+    library.tree[u'Music/Kid A'] = [
+        song(u'Music/Kid A/01.mp3', artist=u'Radiohead', album=u'Kid A',
+             track=u'1', title=u'Everything'),
+        song(u'Music/Kid A/03.mp3', u'2017-02-01', artist=u'Radiohead',
+             album=u'Kid A', track=u'3', title=u'National Anthem'),
+    ]
+    library.tree[u'Music/Amnesiac'] = [
+        song(u'Music/Amnesiac/01.mp3', artist=u'Radiohead',
+             album=u'Amnesiac', track=u'1', title=u'Packt'),
+    ]
+    # retagged in place: directory's Last-Modified doesn't change
+    library.modified = [song(u'Music/Kid A/01.mp3', u'2017-03-01',
+                             artist=u'Radiohead', album=u'Kid A',
+                             track=u'1', title=u'Everything In Its Place')]
+    del library.listed[:]
+
+    idx.sync(200)
+
+    assert idx.db_update == 200
+    assert sorted(titles(idx.search([u'artist', u'radiohead']))) == [
+        u'Everything In Its Place', u'National Anthem', u'Packt']
+    assert idx.search([u'artist', u'joni']) == []
+    assert u'Music/Blue' not in library.listed
+
+
+def test_sync_unchanged(idx, library):
+    """Unchanged leaf directories aren't listed."""
+    del library.listed[:]
+    idx.sync(200)
+    assert library.listed == [u'', u'Music']
+    assert len(idx.search([u'any', u'kid'])) == 2
@@ -0,0 +1,236 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for `mpd.Client` and the functions that send its requests."""
+
+from __future__ import print_function, absolute_import
+
+import threading
+import time
+
+import pytest
+
+from conftest import Hangup
+from lib import mpd
+
+
+def test_response(fake_mpd):
+    """Response is parsed into key/value pairs."""
+    fake_mpd.handler = lambda r: (b'file: a.mp3\nTitle: Name: With Colon\n'
+                                  b'Artist: \xc3\x9c\nOK\n')
+    assert mpd.mpd('currentsong') == [(u'file', u'a.mp3'),
+                                      (u'Title', u'Name: With Colon'),
+                                      (u'Artist', u'\xdc')]
+    assert fake_mpd.requests == [b'currentsong\n']
+
+
+def test_arguments_quoted(fake_mpd):
+    """Arguments are quoted and escaped."""
+    mpd.mpd('find', [u'title', u'Say "Hi" \\o/'])
+    assert fake_mpd.requests == [b'find "title" "Say \\"Hi\\" \\\\o/"\n']
+
+
+def test_ack(fake_mpd):
+    """ACK responses raise `CommandFailed`."""
+    fake_mpd.handler = lambda r: b'ACK [50@0] {lsinfo} No such directory\n'
+    with pytest.raises(mpd.CommandFailed) as exc:
+        mpd.mpd('lsinfo', ['nope'])
+
+    err = exc.value
+    assert (err.code, err.cmd, err.reason) == (
+        mpd.ACK_ERROR_NO_EXIST, u'lsinfo', u'No such directory')
+    # connection is still usable
+    fake_mpd.handler = lambda r: b'OK\n'
+    assert mpd.mpd('ping') == []
+    assert len(fake_mpd.connections) == 1
+
+
+def test_command_list(fake_mpd):
+    """Responses to a command list are split on ``list_OK``."""
+    fake_mpd.handler = lambda r: (b'volume: 50\nlist_OK\nlist_OK\n'
+                                  b'artists: 3\nlist_OK\nOK\n')
+    out = mpd.mpdlist([('status', None), ('ping', None), ('stats', None)])
+    assert out == [[(u'volume', u'50')], [], [(u'artists', u'3')]]
+    assert fake_mpd.requests == [b'command_list_ok_begin\nstatus\nping\n'
+                                 b'stats\ncommand_list_end\n']
+
+
+def test_command_list_ack(fake_mpd):
+    """A failed command in a command list raises `CommandFailed`."""
+    fake_mpd.handler = lambda r: b'list_OK\nACK [5@1] {bogus} unknown\n'
+    with pytest.raises(mpd.CommandFailed) as exc:
+        mpd.mpdlist([('ping', None), ('bogus', None)])
+
+    assert exc.value.cmd == u'bogus'
+
+
+def test_binary(fake_mpd):
+    """Binary responses are read as bytes in chunks."""
+    data = b'\x00\x01OK\n\xff' * 3
+
+    def handler(request):
+        offset = int(request.split(b'"')[3])
+        chunk = data[offset:offset + 10]
+        return (b'size: %d\nbinary: %d\n' % (len(data), len(chunk)) +
+                chunk + b'\nOK\n')
+
+    fake_mpd.handler = handler
+    assert mpd.client().binary('albumart', 'a.mp3') == data
+    assert fake_mpd.count('albumart') == 2
+
+
+def test_iter_cancelled(fake_mpd):
+    """Closing `mpditer` early closes the connection."""
+    fake_mpd.handler = lambda r: b'file: a\nfile: b\nfile: c\nOK\n'
+    pairs = mpd.mpditer('listall')
+    assert next(pairs) == (u'file', u'a')
+    pairs.close()
+    assert not mpd._local.client.connected
+
+
+def test_retry_stale_connection(fake_mpd):
+    """A request isn't sent on a connection MPD has closed."""
+    mpd.mpd('ping')
+    fake_mpd.drop_connections()
+    time.sleep(0.1)
+    assert mpd.mpd('stats') == []
+    assert fake_mpd.count('stats') == 1
+
+
+def test_no_retry_no_response(fake_mpd):
+    """A request sent on a used connection that closes isn't retried."""
+    fake_mpd.handler = lambda r: b'OK\n' if r == b'ping\n' else None
+    mpd.mpd('ping')
+    with pytest.raises(mpd.ConnectionError) as exc:
+        mpd.mpd('update')
+
+    assert not exc.value.retry
+    assert fake_mpd.count('update') == 1
+
+
+def test_no_retry_new_connection(fake_mpd):
+    """A new connection that closes without replying isn't retried."""
+    fake_mpd.handler = lambda r: None
+    with pytest.raises(mpd.ConnectionError):
+        mpd.mpd('findadd', ['artist', 'x'])
+
+    assert fake_mpd.count('findadd') == 1
+
+
+def test_no_retry_after_timeout(fake_mpd, monkeypatch):
+    """Requests that time out aren't sent again."""
+    monkeypatch.setattr(mpd, 'MPD_TIMEOUT', 0.2)
+
+    def handler(request):
+        if b'add' in request:
+            time.sleep(0.5)
+        return b'OK\n'
+
+    fake_mpd.handler = handler
+    mpd.mpd('ping')
+    with pytest.raises(mpd.ConnectionError) as exc:
+        mpd.mpd('findadd', ['artist', 'x'])
+
+    assert not exc.value.retry
+    time.sleep(0.5)
+    assert fake_mpd.count('findadd') == 1
+
+    with pytest.raises(mpd.ConnectionError):
+        mpd.mpdlist([('searchadd', ['artist', 'x']), ('findadd', ['x', 'y'])])
+
+    time.sleep(0.5)
+    assert fake_mpd.count('command_list') == 1
+
+
+def test_no_retry_after_partial_response(fake_mpd):
+    """Requests that were partly answered aren't sent again."""
+    fake_mpd.handler = lambda r: (Hangup(b'file: a\n') if r == b'add "a"\n'
+                                  else b'OK\n')
+    mpd.mpd('ping')
+    with pytest.raises(mpd.ConnectionError):
+        mpd.mpd('add', ['a'])
+
+    assert fake_mpd.count('add') == 1
+
+
+def test_iter_retry(fake_mpd):
+    """`mpditer` follows the same rules as `mpd`."""
+    fake_mpd.handler = lambda r: b'OK\n'
+    mpd.mpd('ping')
+    fake_mpd.drop_connections()
+    time.sleep(0.1)
+    fake_mpd.handler = lambda r: b'file: a\nOK\n'
+    assert list(mpd.mpditer('listall')) == [(u'file', u'a')]
+
+    fake_mpd.handler = lambda r: Hangup(b'file: a\n')
+    with pytest.raises(mpd.ConnectionError):
+        list(mpd.mpditer('listall'))
+
+    assert fake_mpd.count('listall') == 2
+
+
+def test_library_walk(fake_mpd):
+    """`library` walks the directory tree with ``lsinfo``."""
+    listings = {
+        b'""': b'directory: Music\nfile: a.mp3\nTitle: A\n',
+        b'"Music"': b'directory: Music/B\nfile: Music/c.mp3\n',
+        b'"Music/B"': b'file: Music/B/d.mp3\nplaylist: Music/B/p.m3u\n',
+    }
+
+    def handler(request):
+        lines = request.splitlines()[1:-1]
+        return b''.join(listings[l.split(b' ', 1)[1]] + b'list_OK\n'
+                        for l in lines) + b'OK\n'
+
+    fake_mpd.handler = handler
+    out = list(mpd.library(batch_size=1))
+    assert [d.get('file') or d.get('directory') for d in out] == [
+        u'Music', u'a.mp3', u'Music/B', u'Music/c.mp3', u'Music/B/d.mp3']
+    assert out[1]['title'] == u'A'
+    assert fake_mpd.count('listallinfo') == 0
+
+
+def test_batch(fake_mpd):
+    """Commands in a batch are sent in one command list."""
+    fake_mpd.handler = lambda r: b'list_OK\nlist_OK\nOK\n'
+    with mpd.batch() as b:
+        mpd.clear()
+        with mpd.batch():  # nested
+            mpd.queue_track(mpd.Track(u'', u'', u'', u'', u'', u'a.mp3'))
+        assert fake_mpd.requests == []
+
+    assert fake_mpd.requests == [b'command_list_ok_begin\nclear\n'
+                                 b'add "a.mp3"\ncommand_list_end\n']
+    assert b.results == [[], []]
+
+
+def test_batch_thread_local(fake_mpd):
+    """A batch only collects commands sent by its own thread."""
+    with mpd.batch() as b:
+        t = threading.Thread(target=mpd.update)
+        t.start()
+        t.join()
+        assert fake_mpd.requests == [b'update\n']
+        mpd.clear()
+
+    assert b.commands == []
+    assert fake_mpd.count('command_list') == 1
+
+
+def test_batch_clear_play(fake_mpd):
+    """``clear`` and play a track are sent in one exchange."""
+    fake_mpd.handler = lambda r: b'list_OK\nId: 7\nlist_OK\nlist_OK\nOK\n'
+    track = mpd.Track(u'', u'', u'', u'', u'', u'a.mp3')
+    with mpd.batch():
+        mpd.clear()
+        assert mpd.play_track(track) is None
+
+    assert fake_mpd.requests == [b'command_list_ok_begin\nclear\n'
+                                 b'addid "a.mp3" "0"\nplay "0"\n'
+                                 b'command_list_end\n']
@@ -0,0 +1,412 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for queue handling in `lib.mpd`."""
+
+from __future__ import print_function, absolute_import
+
+import re
+
+import pytest
+
+from lib import mpd
+
+
+class Queue(object):
+    """MPD's queue, served by `FakeMPD`.
+
+    Like MPD, it remembers the playlist version at which each song
+    last moved, so it can answer ``plchangesposid``.
+    """
+
+    def __init__(self, server, files=()):
+        """Serve queue of ``files`` via ``server``."""
+        self.version = 1
+        self.ids = []  # song ID at each position
+        self.files = {}  # song ID -> file
+        self.moved = {}  # song ID -> version
+        self.playing = None  # song ID
+        self._next_id = 1
+        server.handler = self.handle
+        self.change(lambda ids: [self._add(f) for f in files])
+
+    def _add(self, path):
+        songid = self._next_id
+        self._next_id += 1
+        self.files[songid] = path
+        return songid
+
+    def change(self, edit):
+        """Replace song IDs with ``edit(ids)`` as a new version."""
+        old = self.ids
+        self.ids = edit(list(old))
+        self.version += 1
+        for pos, songid in enumerate(self.ids):
+            if pos >= len(old) or old[pos] != songid:
+                self.moved[songid] = self.version
+
+    def insert(self, pos, path):
+        """Add ``path`` at position ``pos``."""
+        self.change(lambda ids: ids[:pos] + [self._add(path)] + ids[pos:])
+
+    def delete(self, pos):
+        """Delete song at position ``pos``."""
+        self.change(lambda ids: ids[:pos] + ids[pos + 1:])
+
+    def move(self, start, to):
+        """Move song at ``start`` to position ``to``."""
+        def edit(ids):
+            ids.insert(to, ids.pop(start))
+            return ids
+        self.change(edit)
+
+    def truncate(self, length):
+        """Delete songs at and after ``length``."""
+        self.change(lambda ids: ids[:length])
+
+    def handle(self, request):
+        """Answer ``request``."""
+        lines = request.decode('utf-8').splitlines()
+        if lines[0] != u'command_list_ok_begin':
+            return self._respond(lines[0]) + b'OK\n'
+
+        out = []
+        for line in lines[1:-1]:
+            response = self._respond(line)
+            if response.startswith(b'ACK'):
+                return response
+            out.append(response + b'list_OK\n')
+
+        return b''.join(out) + b'OK\n'
+
+    def _respond(self, line):
+        command = line.split(u' ', 1)[0]
+        args = _args(line)
+        out = []
+        if command == u'status':
+            out = [u'playlist: {}'.format(self.version),
+                   u'playlistlength: {}'.format(len(self.ids))]
+        elif command == u'stats':
+            out = [u'uptime: 100']
+        elif command == u'plchangesposid':
+            out = [u'cpos: {}\nId: {}'.format(p, i)
+                   for p, i in enumerate(self.ids)
+                   if self.moved[i] > int(args[0])]
+        elif command == u'playlistid':
+            i = int(args[0])
+            if i not in self.ids:
+                return b'ACK [50@0] {playlistid} No such song\n'
+            out = [u'file: {}\nPos: {}\nId: {}'.format(
+                self.files[i], self.ids.index(i), i)]
+        elif command == u'playlist':
+            out = [u'{}:file: {}'.format(p, self.files[i])
+                   for p, i in enumerate(self.ids)]
+        elif command == u'playlistfind':
+            out = [u'file: {}\nPos: {}\nId: {}'.format(self.files[i], p, i)
+                   for p, i in enumerate(self.ids)
+                   if self.files[i] == args[1]]
+        elif command == u'delete':
+            start, end = [int(n) for n in args[0].split(u':')]
+            self.change(lambda ids: ids[:start] + ids[end:])
+        elif command == u'deleteid':
+            self.change(lambda ids: [i for i in ids if i != int(args[0])])
+        elif command in (u'add', u'addid'):
+            pos = int(args[1]) if len(args) > 1 else len(self.ids)
+            if pos > len(self.ids):
+                return b'ACK [2@0] {addid} Bad song index\n'
+            self.insert(pos, args[0])
+            if command == u'addid':
+                out = [u'Id: {}'.format(self.ids[pos])]
+        elif command == u'play':
+            self.playing = self.ids[int(args[0])]
+        elif command == u'playid':
+            self.playing = int(args[0])
+
+        return u''.join(s + u'\n' for s in out).encode('utf-8')
+
+    def paths(self):
+        """Return files in queue."""
+        return [self.files[i] for i in self.ids]
+
+
+def _args(line):
+    """Return (quoted) arguments in command ``line``."""
+    return [re.sub(r'\\(.)', r'\1', a)
+            for a in re.findall(r'"((?:[^"\\]|\\.)*)"', line)]
+
+
+def track(path):
+    """Return `mpd.Track` for file ``path``."""
+    return mpd.Track(u'', u'', u'', u'', u'', path)
+
+def check(idx, queue):
+    """Assert that ``idx`` matches ``queue``."""
+    assert idx.version == queue.version
+    assert idx.ids == queue.ids
+    assert idx.files == {i: queue.files[i] for i in queue.ids}
+    for path in set(idx.files.values()):
+        assert idx.find(path) == [(p, i) for p, i in enumerate(queue.ids)
+                                  if queue.files[i] == path]
+
+
+@pytest.mark.parametrize('lookup_max', [mpd.QUEUE_LOOKUP_MAX, 0])
+def test_queue_index(fake_mpd, monkeypatch, lookup_max):
+    """`QueueIndex` follows inserts, moves, deletes and truncation."""
+    monkeypatch.setattr(mpd, 'QUEUE_LOOKUP_MAX', lookup_max)
+    queue = Queue(fake_mpd, [u'a', u'b', u'c', u'd', u'a'])
+    idx = mpd.QueueIndex().update()
+    check(idx, queue)
+    assert u'a' in idx and u'x' not in idx
+
+    steps = [
+        lambda: queue.insert(0, u'x'),
+        lambda: queue.insert(3, u'b'),  # file queued twice
+        lambda: queue.insert(len(queue.ids), u'y'),
+        lambda: queue.move(0, 4),
+        lambda: queue.move(5, 1),
+        lambda: queue.delete(2),
+        lambda: queue.delete(len(queue.ids) - 1),
+        lambda: queue.truncate(3),
+        lambda: queue.truncate(0),
+        lambda: queue.insert(0, u'a'),
+    ]
+    for step in steps:
+        step()
+        version = idx.version
+        del fake_mpd.requests[:]
+        idx.update()
+        check(idx, queue)
+        # asks only for changes since the last update
+        assert fake_mpd.requests[0].count(
+            u'plchangesposid "{}"'.format(version).encode()) == 1
+
+    assert u'b' not in idx and len(idx) == 1
+
+
+def test_queue_index_unchanged(fake_mpd):
+    """Updating an index of an unchanged queue fetches no songs."""
+    queue = Queue(fake_mpd, [u'a', u'b'])
+    idx = mpd.QueueIndex().update()
+    del fake_mpd.requests[:]
+    idx.update()
+    check(idx, queue)
+    assert len(fake_mpd.requests) == 1
+    assert fake_mpd.count('playlist') == 0
+
+
+def test_queue_index_several_changes(fake_mpd):
+    """Changes made between updates are applied together."""
+    queue = Queue(fake_mpd, [u'a', u'b', u'c', u'd'])
+    idx = mpd.QueueIndex().update()
+    queue.move(3, 0)
+    queue.delete(1)
+    queue.insert(1, u'e')
+    queue.truncate(3)
+    idx.update()
+    check(idx, queue)
+
+
+def test_queue_index_restarted(fake_mpd):
+    """Index is rebuilt if MPD's playlist version goes backwards."""
+    queue = Queue(fake_mpd, [u'a', u'b', u'c'])
+    idx = mpd.QueueIndex().update()
+    queue = Queue(fake_mpd, [u'c'])
+    queue.version = 1
+    idx.update()
+    check(idx, queue)
+    assert u'a' not in idx
+
+
+@pytest.mark.parametrize('positions,ranges', [
+    ([], []),
+    ([3, 4, 5], [(3, 6)]),
+    ([0, 1, 3, 5, 6], [(0, 2), (3, 4), (5, 7)]),
+    ([5, 3, 4, 0], [(0, 1), (3, 6)]),  # unsorted
+    ([2, 2, 3, 3, 7], [(2, 4), (7, 8)]),  # duplicates
+])
+def test_ranges(positions, ranges):
+    """Positions are collapsed into sorted ``START:END`` ranges."""
+    assert mpd._ranges(positions) == ranges
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_remove_tracks(fake_mpd, use_index):
+    """Runs of songs are deleted by range, single songs by ID."""
+    queue = Queue(fake_mpd, [u'a', u'b', u'a', u'a', u'c', u'b', u'd'])
+    index = mpd.QueueIndex().update() if use_index else None
+    del fake_mpd.requests[:]
+    tracks = [track(u'b'), track(u'a'), track(u'a')]  # duplicate track
+    assert mpd.remove_tracks(tracks, index) == 5
+    assert queue.paths() == [u'c', u'd']
+    assert fake_mpd.requests[-1] == (b'command_list_ok_begin\n'
+                                     b'deleteid "6"\ndelete "0:4"\n'
+                                     b'command_list_end\n')
+    # lookup (without index) and deletions
+    assert len(fake_mpd.requests) == 1 + (not use_index)
+
+
+def test_remove_tracks_not_adjacent(fake_mpd):
+    """Songs that aren't next to each other are deleted by ID."""
+    queue = Queue(fake_mpd, [u'a', u'b', u'a', u'c', u'a'])
+    assert mpd.remove_track(track(u'a')) == 3
+    assert queue.paths() == [u'b', u'c']
+    assert fake_mpd.requests[-1] == (b'command_list_ok_begin\n'
+                                     b'deleteid "5"\ndeleteid "3"\n'
+                                     b'deleteid "1"\ncommand_list_end\n')
+
+
+def test_remove_tracks_not_queued(fake_mpd):
+    """Nothing is deleted if no songs are found."""
+    queue = Queue(fake_mpd, [u'a'])
+    assert mpd.remove_track(track(u'x')) == 0
+    assert queue.paths() == [u'a']
+    assert not [r for r in fake_mpd.requests if b'delete' in r]
+
+
+def _added(request):
+    """Return response to command list that adds tracks to queue."""
+    n = request.count(b'\n') - 2
+    return b'playlistlength: 3\nlist_OK\n' + b'list_OK\n' * (n - 2) + \
+        b'playlistlength: 5\nlist_OK\nOK\n'
+
+
+@pytest.mark.parametrize('query,exact,position,command', [
+    (u'artist:radio head', False, None,
+     b'searchadd "(artist contains \'radio head\')"\n'),
+    (u'artist:radiohead !genre:rock', False, None,
+     b'searchadd "((artist contains \'radiohead\') AND '
+     b'(!(genre contains \'rock\')))"\n'),
+    (u'artist=Radiohead album!=Kid A', False, 2,
+     b'searchadd "((artist == \'Radiohead\') AND (album != \'Kid A\'))" '
+     b'"position" "2"\n'),
+    (u'artist:Radiohead', True, None, b'findadd "(artist == \'Radiohead\')"\n'),
+])
+def test_queue_query(fake_mpd, query, exact, position, command):
+    """MPD adds results of a filter expression (MPD 0.21+)."""
+    fake_mpd.handler = _added
+    assert mpd.queue_query(query, exact, position) == 2
+    assert fake_mpd.requests == [b'command_list_ok_begin\nstatus\n' +
+                                 command + b'status\ncommand_list_end\n']
+
+
+def test_queue_query_batch(fake_mpd):
+    """In a `Batch`, results are added with the batch's other commands."""
+    fake_mpd.handler = lambda r: b'list_OK\nlist_OK\nOK\n'
+    with mpd.batch():
+        mpd.clear()
+        assert mpd.queue_query(u'album:kid a') is None
+
+    assert fake_mpd.requests == [b'command_list_ok_begin\nclear\n'
+                                 b'findadd "(album == \'kid a\')"\n'
+                                 b'command_list_end\n']
+
+
+def test_queue_query_positional(fake_mpd):
+    """MPD older than 0.21 gets type & query pairs."""
+    fake_mpd.version = '0.20.0'
+    fake_mpd.handler = _added
+    assert mpd.queue_query(u'artist:radiohead album:kid a', False) == 2
+    assert fake_mpd.requests[0].splitlines()[2] == \
+        b'searchadd "artist" "radiohead" "album" "kid a"'
+
+
+def _search_handler(results):
+    """Return handler answering ``search`` & ``find`` with ``results``."""
+    def handler(request):
+        if request.startswith((b'search', b'find')):
+            return results + b'OK\n'
+        return b'list_OK\n' * (request.count(b'\n') - 2) + b'OK\n'
+
+    return handler
+
+
+def test_queue_query_fallback(fake_mpd):
+    """Negated terms are filtered here on MPD older than 0.21."""
+    fake_mpd.version = '0.20.0'
+    fake_mpd.handler = _search_handler(
+        b'file: a\nGenre: Rock\nfile: b\nGenre: Jazz\n'
+        b'file: c\nfile: d\nGenre: rock\n')
+    assert mpd.queue_query(u'artist:radiohead !genre:rock', False) == 2
+    assert fake_mpd.requests == [b'search "artist" "radiohead"\n',
+                                 b'command_list_ok_begin\nadd "b"\n'
+                                 b'add "c"\ncommand_list_end\n']
+
+
+def test_queue_query_position_fallback(fake_mpd):
+    """Results are inserted with ``addid`` on MPD older than 0.23."""
+    fake_mpd.version = '0.22.0'
+    fake_mpd.handler = _search_handler(b'file: a\nfile: b\n')
+    assert mpd.queue_query(u'artist:radiohead', position=4) == 2
+    assert fake_mpd.requests == [b'find "(artist == \'radiohead\')"\n',
+                                 b'command_list_ok_begin\naddid "a" "4"\n'
+                                 b'addid "b" "5"\ncommand_list_end\n']
+
+
+def test_queue_query_no_results(fake_mpd):
+    """Nothing is added if nothing matches."""
+    fake_mpd.version = '0.20.0'
+    fake_mpd.handler = _search_handler(b'')
+    assert mpd.queue_query(u'!artist:radiohead', position=0) == 0
+    assert fake_mpd.count('command_list') == 0
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_play_track_queued(fake_mpd, use_index):
+    """A queued file is played by ID (its first song, if several)."""
+    queue = Queue(fake_mpd, [u'a', u'b', u'c', u'b'])
+    index = mpd.QueueIndex().update() if use_index else None
+    del fake_mpd.requests[:]
+    assert mpd.play_track(track(u'b'), index) == 2
+    assert queue.playing == 2
+    assert fake_mpd.requests[-1] == b'playid "2"\n'
+    assert fake_mpd.count('command_list_ok_begin\nplaylistfind') == \
+        (not use_index)
+    assert queue.paths() == [u'a', u'b', u'c', u'b']
+
+
+@pytest.mark.parametrize('use_index', [False, True])
+def test_play_track_add(fake_mpd, use_index):
+    """A file that isn't queued is added at the end and played."""
+    queue = Queue(fake_mpd, [u'a', u'b'])
+    index = mpd.QueueIndex().update() if use_index else None
+    del fake_mpd.requests[:]
+    assert mpd.play_track(track(u'x'), index) == 3
+    assert queue.paths() == [u'a', u'b', u'x']
+    assert queue.playing == 3
+    assert fake_mpd.requests[-1] == (b'command_list_ok_begin\n'
+                                     b'addid "x" "2"\nplay "2"\n'
+                                     b'command_list_end\n')
+    assert len(fake_mpd.requests) == 1 + (not use_index)
+
+
+def test_play_track_queue_shortened(fake_mpd):
+    """Nothing is played if the queue is shorter than the index says."""
+    queue = Queue(fake_mpd, [u'a', u'b'])
+    index = mpd.QueueIndex().update()
+    queue.truncate(1)
+    with pytest.raises(mpd.CommandFailed):
+        mpd.play_track(track(u'x'), index)
+
+    assert queue.paths() == [u'a']
+    assert queue.playing is None
+
+
+def test_play_track_batch(fake_mpd):
+    """Changes to the queue in a `Batch` are sent before the lookup."""
+    queue = Queue(fake_mpd, [u'a'])
+    index = mpd.QueueIndex().update()
+    with mpd.batch():
+        mpd.queue_track(track(u'x'))
+        assert mpd.play_track(track(u'x'), index) == 2
+        assert queue.paths() == [u'a', u'x']
+        assert queue.playing is None
+
+    assert queue.playing == 2
+    assert fake_mpd.requests[-1] == b'command_list_ok_begin\nplayid "2"\n' \
+        b'command_list_end\n'
@@ -0,0 +1,87 @@
+# encoding: utf-8
+#
+# Copyright (c) 2017 Dean Jackson <deanishe@deanishe.net>
+#
+# MIT Licence. See http://opensource.org/licenses/MIT
+#
+# Created on 2017-03-13
+#
+
+"""Tests for parsing search queries and refining search results."""
+
+from __future__ import print_function, absolute_import
+
+from lib import mpd
+
+SONGS = (b'file: 1.mp3\nArtist: Caf\xc3\xa9 Tacvba\nTitle: Eres\n'
+         b'file: 2.mp3\nArtist: Cafe Bleu\nTitle: Paris\n'
+         b'file: 3.mp3\nArtist: Cafe Band\nArtist: Sly\nTitle: Duet\n'
+         b'OK\n')
+
+
+def _files(results):
+    """Return paths of songs in ``results``."""
+    return [d['file'] for d in results.songs]
+
+
+def test_refine_keeps_diacritics(fake_mpd):
+    """Refining ignores case, but not diacritics, like MPD."""
+    fake_mpd.handler = lambda r: SONGS
+    previous = mpd.search_results(u'caf')
+    assert previous.complete
+
+    results = mpd.search_results(u'CAFÉ', previous)
+    assert _files(results) == [u'1.mp3']
+    results = mpd.search_results(u'cafe', previous)
+    assert _files(results) == [u'2.mp3', u'3.mp3']
+    assert fake_mpd.count('search') == 1
+
+
+def test_refine_multi_value_tags(fake_mpd):
+    """All values of multi-value tags are refined."""
+    fake_mpd.handler = lambda r: SONGS
+    previous = mpd.search_results(u'artist:l')
+    results = mpd.search_results(u'artist:sly', previous)
+    assert _files(results) == [u'3.mp3']
+    previous = mpd.search_results(u'y')
+    results = mpd.search_results(u'sly', previous)
+    assert _files(results) == [u'3.mp3']
+    assert fake_mpd.count('search') == 2
+    # tracks show the first value
+    assert results.tracks[0].artist == u'Cafe Band'
+
+
+def test_parse_query_space_after_colon():
+    """A space between type and value isn't part of the value."""
+    expected = [mpd.Term(u'artist', False, False, u'radiohead')]
+    assert mpd._parse_query(u'artist: radiohead') == expected
+    assert mpd._parse_query(u'artist:  "radiohead"') == expected
+    assert mpd._parse_query(u'artist: the cure') == [
+        mpd.Term(u'artist', False, False, u'the cure')]
+    assert mpd._positional(mpd._parse_query(u'artist: radiohead')) == [
+        u'artist', u'radiohead']
+    assert mpd._filter_expression(mpd._parse_query(u'artist: radiohead'),
+                                  'search') == \
+        u"(artist contains 'radiohead')"
+
+
+def test_parse_query_unknown_type():
+    """Words that only look like typed terms match ``any``."""
+    assert mpd._parse_query(u'E=MC2') == [
+        mpd.Term(u'any', False, False, u'E=MC2')]
+    assert mpd._parse_query(u'a:b') == [
+        mpd.Term(u'any', False, False, u'a:b')]
+    assert mpd._parse_query(u'bogus:x artist:y') == [
+        mpd.Term(u'any', False, False, u'bogus:x'),
+        mpd.Term(u'artist', False, False, u'y')]
+
+
+def test_parse_query_operators():
+    """Known types take ``:``, ``=`` and ``!=``, and ``!`` negates."""
+    assert mpd._parse_query(u'!artist=x') == [
+        mpd.Term(u'artist', True, True, u'x')]
+    assert mpd._parse_query(u'Artist!=x') == [
+        mpd.Term(u'Artist', True, True, u'x')]
+    assert mpd._parse_query(u'file:a.mp3 modified-since:2020') == [
+        mpd.Term(u'file', False, False, u'a.mp3'),
+        mpd.Term(u'modified-since', False, False, u'2020')]